@@ -1,25 +1,159 @@
+import asyncio
+import configparser
+import hashlib
 import socket
 import io
 import os
+import select
 import stat
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
-from omsi_utility import OmsiQuestion
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from omsi_connect import (
+    TLS_WOULD_BLOCK,
+    OmsiSocketOptions,
+    connect_happy_eyeballs,
+    default_socket_options,
+    is_tls_socket,
+    remember_tls_session,
+    resolver,
+    wrap_tls,
+)
+from omsi_failover import OmsiEndpointSelector
+from omsi_metrics import metrics
+from omsi_ratelimit import OmsiTokenBucket, download_budget, upload_budget
+from omsi_retry import OmsiRetryPolicy
+from omsi_utility import OmsiQuestion, OmsiQuestionParser
 
 SOCKET_CHUNK_SIZE = 1024
+SOCKET_MAX_CHUNK_SIZE = 256 * 1024
+SOCKET_CHUNK_TARGET_TIME = 0.05
+SOCKET_MAX_SEGMENTS = 64
+POOL_MAX_IDLE = 2
+POOL_MAX_IDLE_TIME = 20
+STANDBY_CHECK_INTERVAL = 5
+BATCH_MAX_WORKERS = 4
+FILE_DIGEST = "sha256"
 
 COMMAND_GET_QUESTIONS = "ClientWantsQuestions"
 COMMAND_GET_SUPP = "ClientWantsSuppFile"
+COMMAND_COMPRESSED = "ClientWantsCompressed"
+COMMAND_IF_CHANGED = "ClientWantsIfChanged"
 RESPONSE_ACCEPT_READY = "ReadyToAcceptClientFile"
+RESPONSE_COMPRESSED = "CompressedFile"
+RESPONSE_MODIFIED = "FileModified"
+RESPONSE_NOT_MODIFIED = "FileNotModified"
+
+# Compressed transfers are an extension to the OMSI protocol. The client sends
+#   ClientWantsCompressed\0<command>\0<encoding>,<encoding>...
+# and a server that supports it answers with
+#   CompressedFile\0<encoding>\0<payload length>\0<payload>
+# where the encoding is one of those offered or "identity".
+#
+# Conditional fetches are another extension. The client sends
+#   ClientWantsIfChanged\0<command>\0<sha256 of the cached file>
+# and the server answers FileNotModified\0, or FileModified\0 followed by the
+# usual NUL-terminated file.
+#
+# Servers that reply to an extension with anything else are remembered as
+# legacy servers and get plain requests from then on.
+TRANSFER_ENCODINGS = {"zlib": zlib.decompressobj}
+if lzma is not None:
+    TRANSFER_ENCODINGS["lzma"] = lzma.LZMADecompressor
+TRANSFER_IDENTITY = "identity"
+HEADER_MAX_SIZE = 256
+RESPONSE_MAX_SIZE = 4096
+RESPONSE_SETTLE_TIME = 0.05
+EXTENSION_NEGOTIATE_TIMEOUT = 2
 
 EXAM_QUESTIONS_FILE = "ExamQuestions.txt"
 CODE_FILE = "code.R"
 SUPP_FILE = "SuppFile"
+CACHE_FILE = "cache.ini"
+SUBMISSIONS_FILE = "submissions.ini"
 VERSION = open("VERSION", "r").read()
 
 
+def file_digest(path):
+    digest = hashlib.new(FILE_DIGEST)
+
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(SOCKET_MAX_CHUNK_SIZE)
+
+            if len(chunk) == 0:
+                break
+
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class OmsiFileSink:
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = path + ".part"
+        self.file = None
+        self.digest = hashlib.new(FILE_DIGEST)
+        self.aborted = False
+
+    def __enter__(self):
+        self.file = open(self.temp_path, "wb")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        self.file = None
+
+        if exc_type is None and not self.aborted:
+            os.replace(self.temp_path, self.path)
+        else:
+            os.remove(self.temp_path)
+
+    def write(self, data):
+        self.file.write(data)
+        self.digest.update(data)
+
+    def reset(self):
+        self.file.seek(0)
+        self.file.truncate()
+        self.digest = hashlib.new(FILE_DIGEST)
+
+    # Leaves the existing file in place instead of replacing it on exit.
+    def abort(self):
+        self.aborted = True
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+# Passes everything written to a sink on to an observer as well, such as a
+# parser that handles the file while it is still downloading.
+class OmsiTeeSink:
+    def __init__(self, sink, observer):
+        self.sink = sink
+        self.observer = observer
+
+    def write(self, data):
+        self.sink.write(data)
+        self.observer.write(data)
+
+    def reset(self):
+        self.sink.reset()
+        self.observer.reset()
+
+
 class OmsiDataManager:
     def __init__(self, exam_id):
         self.exam_id = exam_id
+        self.records_lock = threading.Lock()
 
     def create_exam_dir(self):
         if not os.path.exists("exams"):
@@ -34,6 +168,9 @@ class OmsiDataManager:
     def questions_path(self):
         return self.file_path(EXAM_QUESTIONS_FILE)
 
+    def supp_path(self):
+        return self.file_path(SUPP_FILE)
+
     def file_path(self, file):
         return os.path.join(self.get_exam_dir(), file)
 
@@ -50,8 +187,78 @@ class OmsiDataManager:
     def write_code(self, buff):
         self.write_buffer_to_file(self.file_path(CODE_FILE), buff)
 
+    def read_records(self, records_file):
+        config = configparser.ConfigParser()
+
+        with self.records_lock:
+            config.read(self.file_path(records_file))
+
+        return config
+
+    def write_record(self, records_file, section, values):
+        with self.records_lock:
+            config = configparser.ConfigParser()
+            config.read(self.file_path(records_file))
+            config[section] = values
+
+            with open(self.file_path(records_file), "w") as f:
+                config.write(f)
+
+    # Returns the digest and fetch time of a downloaded file, provided the copy
+    # on disk still matches what was downloaded.
+    def cached_file(self, file):
+        config = self.read_records(CACHE_FILE)
+
+        if file not in config or not os.path.exists(self.file_path(file)):
+            return None
+
+        digest = config[file]["digest"]
+
+        if file_digest(self.file_path(file)) != digest:
+            return None
+
+        return digest, float(config[file]["fetched_at"])
+
+    def record_cached_file(self, file, digest):
+        self.write_record(
+            CACHE_FILE, file, {"digest": digest, "fetched_at": time.time()}
+        )
+
+    def record_submission(self, file_name, digest):
+        self.write_record(
+            SUBMISSIONS_FILE,
+            file_name,
+            {"digest": digest, "submitted_at": time.time()},
+        )
+
+    # True if the saved answer is byte-identical to the last one the server
+    # accepted for this question.
+    def is_submitted(self, question: OmsiQuestion):
+        config = self.read_records(SUBMISSIONS_FILE)
+        file_name = self.answer_file_name(question)
+
+        if file_name not in config or not os.path.exists(self.file_path(file_name)):
+            return False
+
+        return file_digest(self.file_path(file_name)) == config[file_name]["digest"]
+
+    def file_sink(self, file):
+        return OmsiFileSink(self.file_path(file))
+
+    def questions_sink(self):
+        return self.file_sink(EXAM_QUESTIONS_FILE)
+
+    def supp_sink(self):
+        return self.file_sink(SUPP_FILE)
+
+    def answer_file_name(self, question: OmsiQuestion):
+        return f"omsi_answer{question.number}{question.get_filetype()}"
+
+    def answer_path(self, question: OmsiQuestion):
+        return self.file_path(self.answer_file_name(question))
+
     def save_answer(self, question: OmsiQuestion):
-        answer_file = f"omsi_answer{question.number}{question.get_filetype()}"
+        answer_file = self.answer_file_name(question)
 
         with open(answer_file, "w") as f:
             os.chmod(
@@ -63,17 +270,630 @@ class OmsiDataManager:
             )
             f.write(question.get_answer())
 
-        with open(self.file_path(answer_file), "w") as f:
+        # This copy is what gets uploaded, so keep it byte-identical to the
+        # UTF-8 encoded answer on every platform.
+        with open(self.answer_path(question), "w", encoding="utf-8", newline="") as f:
             f.write(question.get_answer())
 
 
-class OmsiSocketClient:
-    def __init__(self, hostname, port, email, exam_id):
+# Chunk sizes start at SOCKET_CHUNK_SIZE and double while transfers keep
+# filling whole chunks quickly, up to the smaller of max_size and the socket
+# buffer. Chunks that take longer than SOCKET_CHUNK_TARGET_TIME shrink again.
+class OmsiChunkSizer:
+    def __init__(self, max_size=SOCKET_MAX_CHUNK_SIZE):
+        self.max_size = max(max_size, SOCKET_CHUNK_SIZE)
+        self.ceiling = self.max_size
+        self.size = SOCKET_CHUNK_SIZE
+
+    def limit_to_socket(self, sock, option):
+        buffer_size = sock.getsockopt(socket.SOL_SOCKET, option)
+        self.ceiling = max(min(self.max_size, buffer_size), SOCKET_CHUNK_SIZE)
+        self.size = min(self.size, self.ceiling)
+
+    def update(self, requested, transferred, elapsed):
+        if elapsed > SOCKET_CHUNK_TARGET_TIME:
+            self.size = max(self.size // 2, SOCKET_CHUNK_SIZE)
+        elif transferred >= requested:
+            self.size = min(self.size * 2, self.ceiling)
+
+
+class OmsiReceiveBuffer:
+    def __init__(self, size=SOCKET_CHUNK_SIZE):
+        self.buffer = bytearray(size)
+        self.length = 0
+
+    def reset(self):
+        self.length = 0
+
+    def reserve(self, size):
+        free = len(self.buffer) - self.length
+
+        if free < size:
+            self.buffer.extend(bytes(max(size - free, len(self.buffer))))
+
+    def recv_into(self, sock, size=SOCKET_CHUNK_SIZE):
+        self.reserve(size)
+
+        with memoryview(self.buffer) as view:
+            with view[self.length : self.length + size] as target:
+                received = sock.recv_into(target)
+
+        self.length += received
+        return received
+
+    def last_byte(self):
+        return self.buffer[self.length - 1] if self.length else None
+
+    def truncate(self, length):
+        self.length = length
+
+    def consume(self, size):
+        if size >= self.length:
+            self.length = 0
+            return
+
+        del self.buffer[:size]
+        self.length -= size
+
+    def append(self, data):
+        self.reserve(len(data))
+        self.buffer[self.length : self.length + len(data)] = data
+        self.length += len(data)
+
+    def getbuffer(self):
+        return memoryview(self.buffer)[: self.length]
+
+    def getvalue(self):
+        return bytes(self.getbuffer())
+
+
+class OmsiProtocolError(ConnectionError):
+    pass
+
+
+# Splits what the server sends into messages, keeping any bytes past the end
+# of one for the next. Messages end with a NUL, but legacy servers send some
+# replies bare, so a reply also ends once it spells out one of the replies
+# the caller expects, once it cannot be one of them, or (when any reply will
+# do) once nothing more has arrived for RESPONSE_SETTLE_TIME.
+# The reader only frames buffered data; the client fills the buffer.
+class OmsiResponseReader:
+    def __init__(self):
+        self.buffer = OmsiReceiveBuffer()
+        self.reset()
+
+    def reset(self):
+        self.buffer.reset()
+        self.closed = False
+        self.skip_terminator = False
+
+    def peek(self, size):
+        with self.buffer.getbuffer() as view:
+            return bytes(view[:size])
+
+    def split(self, length, terminator=1):
+        message = self.peek(length)
+        self.buffer.consume(length + terminator)
+        return message.decode(errors="replace")
+
+    # Returns the next message, or None if more data is needed first.
+    def next_message(self, expected=(), settled=False):
+        if self.skip_terminator and self.buffer.length:
+            self.skip_terminator = False
+
+            if self.peek(1) == b"\0":
+                self.buffer.consume(1)
+
+        data = self.peek(RESPONSE_MAX_SIZE)
+        end = data.find(b"\0")
+
+        if end != -1:
+            return self.split(end)
+
+        replies = [reply.encode() for reply in expected]
+
+        for reply in replies:
+            if data.startswith(reply):
+                # The NUL may still be on its way.
+                self.skip_terminator = True
+                return self.split(len(reply), 0)
+
+        if replies:
+            complete = not any(reply.startswith(data) for reply in replies)
+        else:
+            complete = settled
+
+        if data and (complete or self.closed or len(data) >= RESPONSE_MAX_SIZE):
+            return self.split(len(data), 0)
+
+        if self.closed:
+            raise ConnectionResetError("Server closed the connection")
+
+        return None
+
+    # Returns the next field_count NUL-terminated fields, or None if more data
+    # is needed first.
+    def next_fields(self, field_count):
+        header = self.peek(HEADER_MAX_SIZE)
+
+        if header.count(b"\0") >= field_count:
+            fields = header.split(b"\0", field_count)[:field_count]
+            self.buffer.consume(sum(len(field) + 1 for field in fields))
+            return [field.decode(errors="replace") for field in fields]
+
+        if self.closed:
+            raise ConnectionResetError("Server closed the connection")
+
+        if len(header) >= HEADER_MAX_SIZE:
+            raise OmsiProtocolError("Reply header is too long")
+
+        return None
+
+
+class OmsiSendStats:
+    def __init__(self):
+        self.bytes_sent = 0
+        self.syscalls = 0
+
+
+class OmsiFrameWriter:
+    def __init__(
+        self,
+        sock,
+        stats: OmsiSendStats,
+        sizer: OmsiChunkSizer = None,
+        on_sent=None,
+        limit: OmsiTokenBucket = None,
+    ):
+        self.socket = sock
+        self.stats = stats
+        self.sizer = sizer or OmsiChunkSizer(SOCKET_CHUNK_SIZE)
+        self.on_sent = on_sent
+        self.limit = limit
+
+    # Sends every segment in full, gathering up to SOCKET_MAX_SEGMENTS of them
+    # into a single sendmsg call where the platform supports it (not Windows,
+    # and not over TLS). Under a rate limit, data goes out a chunk at a time
+    # so it is paced evenly.
+    def write(self, segments):
+        views = [memoryview(segment) for segment in segments if len(segment)]
+        vectored = hasattr(self.socket, "sendmsg") and not is_tls_socket(self.socket)
+        limited = self.limit is not None and self.limit.is_limited()
+
+        while views:
+            if limited:
+                size = self.limit.chunk_size(self.sizer.size, SOCKET_CHUNK_SIZE)
+                batch = [views[0][:size]]
+            else:
+                batch = views[:SOCKET_MAX_SEGMENTS] if vectored else views[:1]
+
+            start = time.monotonic()
+
+            if vectored:
+                sent = self.socket.sendmsg(batch)
+            else:
+                sent = self.socket.send(batch[0])
+
+            self.sizer.update(
+                sum(len(view) for view in batch), sent, time.monotonic() - start
+            )
+            self.stats.syscalls += 1
+            self.stats.bytes_sent += sent
+
+            if self.on_sent is not None:
+                self.on_sent(sent)
+
+            if limited:
+                self.limit.consume(sent)
+
+            while sent:
+                if sent >= len(views[0]):
+                    sent -= len(views[0])
+                    views.pop(0)
+                else:
+                    views[0] = views[0][sent:]
+                    sent = 0
+
+
+# A payload that every upload attempt can replay from the start: either a file
+# on disk, which is reopened each time, or an in-memory buffer, which is sent
+# through memoryview slices. The digest and size are computed once up front,
+# and the digest is what callers record once the upload has been accepted.
+class OmsiUploadSource:
+    def __init__(self, data=None, path=None):
+        self.path = path
+        self.data = None
+        digest = hashlib.new(FILE_DIGEST)
+
+        if path is not None:
+            self.size = 0
+
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(SOCKET_MAX_CHUNK_SIZE)
+
+                    if len(chunk) == 0:
+                        break
+
+                    digest.update(chunk)
+                    self.size += len(chunk)
+        else:
+            self.data = memoryview(data).cast("B")
+            self.size = len(self.data)
+            digest.update(self.data)
+
+        self.digest = digest.hexdigest()
+
+    @staticmethod
+    def create(file_bytes=None, file_path=None):
+        if isinstance(file_bytes, OmsiUploadSource):
+            return file_bytes
+
+        if file_path is not None:
+            return OmsiUploadSource(path=file_path)
+
+        if isinstance(file_bytes, (bytes, bytearray, memoryview)):
+            return OmsiUploadSource(file_bytes)
+
+        return OmsiUploadSource(file_bytes.read())
+
+    # Reads the whole file now, so that saving it again during the upload
+    # changes neither what is sent nor the digest recorded for it.
+    @staticmethod
+    def snapshot(path):
+        with open(path, "rb") as f:
+            return OmsiUploadSource(f.read())
+
+    def chunks(self, size):
+        if self.path is None:
+            for offset in range(0, self.size, size):
+                yield self.data[offset : offset + size]
+
+            return
+
+        with open(self.path, "rb") as f:
+            while True:
+                chunk = f.read(size)
+
+                if len(chunk) == 0:
+                    break
+
+                yield chunk
+
+
+def connect_socket(hostname, port, tls_context=None, options: OmsiSocketOptions = None):
+    options = options or default_socket_options
+
+    try:
+        sock = connect_happy_eyeballs(
+            resolver.resolve(hostname, port), options.connect_timeout, options=options
+        )
+    except OSError:
+        resolver.invalidate(hostname, port)
+        raise
+
+    sock.settimeout(options.read_timeout)
+
+    if tls_context is not None:
+        sock = wrap_tls(sock, tls_context, hostname, port)
+
+    return sock
+
+
+# An idle connection has nothing left to read, so a readable one has either
+# been closed by the server or holds stray bytes; neither can be reused.
+# TLS connections may also have session tickets waiting, which are consumed
+# by a non-blocking read that yields no application data.
+def socket_is_reusable(sock):
+    try:
+        timeout = sock.gettimeout()
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+
+    if not readable:
+        return True
+
+    if not is_tls_socket(sock):
+        return False
+
+    try:
+        sock.setblocking(False)
+        sock.recv(1)
+        return False
+    except TLS_WOULD_BLOCK:
+        return True
+    except OSError:
+        return False
+    finally:
+        try:
+            sock.settimeout(timeout)
+        except OSError:
+            pass
+
+
+# Idle connections are kept as (socket, time released) pairs and are not
+# handed out once they have been idle for max_idle_time seconds, since the
+# server may be about to drop them.
+class OmsiConnectionPool:
+    def __init__(
+        self,
+        hostname,
+        port,
+        tls_context=None,
+        max_idle=POOL_MAX_IDLE,
+        options: OmsiSocketOptions = None,
+        max_idle_time=POOL_MAX_IDLE_TIME,
+    ):
         self.hostname = hostname
         self.port = port
+        self.tls_context = tls_context
+        self.max_idle = max_idle
+        self.options = options
+        self.max_idle_time = max_idle_time
+        self.idle = []
+        self.lock = threading.Lock()
+        self.acquired = threading.Event()
+
+    def connect(self):
+        return connect_socket(self.hostname, self.port, self.tls_context, self.options)
+
+    def acquire(self):
+        try:
+            with self.lock:
+                while self.idle:
+                    sock, released = self.idle.pop()
+
+                    if (
+                        time.monotonic() - released < self.max_idle_time
+                        and socket_is_reusable(sock)
+                    ):
+                        return sock, True
+
+                    sock.close()
+
+            return self.connect(), False
+        finally:
+            self.acquired.set()
+
+    def release(self, sock):
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append((sock, time.monotonic()))
+                return
+
+        sock.close()
+
+    # Closes idle connections that are older than max_age or unusable, and
+    # returns how many are left.
+    def prune(self, max_age):
+        with self.lock:
+            idle, self.idle = self.idle, []
+
+            for sock, released in idle:
+                if time.monotonic() - released < max_age and socket_is_reusable(sock):
+                    self.idle.append((sock, released))
+                else:
+                    sock.close()
+
+            return len(self.idle)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+
+        for sock, _ in idle:
+            sock.close()
+
+
+connection_pools = {}
+connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(
+    hostname,
+    port,
+    tls_context=None,
+    options: OmsiSocketOptions = None,
+    max_idle_time=POOL_MAX_IDLE_TIME,
+):
+    with connection_pools_lock:
+        key = (hostname, int(port), id(tls_context), id(options))
+
+        if key not in connection_pools:
+            connection_pools[key] = OmsiConnectionPool(
+                hostname,
+                port,
+                tls_context,
+                options=options,
+                max_idle_time=max_idle_time,
+            )
+
+        return connection_pools[key]
+
+
+# Keeps a validated, unused connection to the client's server waiting in the
+# pool while the student works, so that the next submit or fetch skips
+# connecting (and the TLS handshake). The standby is replaced before the pool
+# would consider it too old, and again as soon as it has been taken, so each
+# student opens a connection every max_idle_time - STANDBY_CHECK_INTERVAL
+# seconds for as long as the warmer runs.
+class OmsiConnectionWarmer:
+    def __init__(self, client: "OmsiSocketClient"):
+        self.client = client
+        self.stopped = False
+        self.pool = None
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+
+        if self.pool is not None:
+            self.pool.acquired.set()
+
+    def current_pool(self):
+        client = self.client
+        endpoint = client.selector.best() if client.selector is not None else client
+
+        return get_connection_pool(
+            endpoint.hostname,
+            endpoint.port,
+            client.tls_context,
+            client.socket_options,
+            client.pool_idle_time,
+        )
+
+    def run(self):
+        while not self.stopped:
+            self.pool = self.current_pool()
+            self.pool.acquired.clear()
+
+            if self.pool.prune(self.pool.max_idle_time - STANDBY_CHECK_INTERVAL) == 0:
+                try:
+                    self.pool.release(self.pool.connect())
+                except OSError:
+                    # Unreachable for now, try again at the next check.
+                    pass
+
+            self.pool.acquired.wait(STANDBY_CHECK_INTERVAL)
+
+
+class OmsiExtensionUnsupportedError(Exception):
+    pass
+
+
+# Receives transport events from an OmsiSocketClient, for progress bars,
+# tracing and the like. Subclasses override the events they care about.
+# Events are delivered on the thread doing the I/O, so observers should
+# return quickly.
+class OmsiClientObserver:
+    def connect_start(self, client):
+        pass
+
+    # error is the exception if the connection could not be opened.
+    def connect_end(self, client, reused, error=None):
+        pass
+
+    def bytes_sent(self, client, size):
+        pass
+
+    def bytes_received(self, client, size):
+        pass
+
+    def response_received(self, client, response):
+        pass
+
+    def retry(self, client, attempt, error, delay):
+        pass
+
+    def close(self, client):
+        pass
+
+
+extension_support = {}
+
+
+class OmsiSocketClient:
+    def __init__(
+        self,
+        hostname,
+        port,
+        email,
+        exam_id,
+        max_chunk_size=SOCKET_MAX_CHUNK_SIZE,
+        reuse_connections=False,
+        retry_policy: OmsiRetryPolicy = None,
+        compression=False,
+        tls_context=None,
+        socket_options: OmsiSocketOptions = None,
+        upload_limit: OmsiTokenBucket = None,
+        download_limit: OmsiTokenBucket = None,
+        selector: OmsiEndpointSelector = None,
+        pool_idle_time=POOL_MAX_IDLE_TIME,
+        revalidate=False,
+    ):
         self.email = email
         self.exam_id = exam_id
+        self.compression = compression
+        # Like compression, asking whether a cached file changed is opt-in:
+        # a server without the extension costs a read timeout per file.
+        self.revalidate = revalidate
+        self.upload_limit = upload_limit or upload_budget
+        self.download_limit = download_limit or download_budget
+        self.tls_context = tls_context
+        self.socket_options = socket_options or default_socket_options
+        self.reuse_connections = reuse_connections
+        self.pool_idle_time = pool_idle_time
+        self.selector = selector
+        self.endpoint = None
         self.socket = None
+        self.timeout = None
+        self.retry_policy = retry_policy or OmsiRetryPolicy()
+        self.use_endpoint(hostname, port)
+        self.reused = False
+        self.exchanged = False
+        self.reader = OmsiResponseReader()
+        self.receive_sizer = OmsiChunkSizer(max_chunk_size)
+        self.send_sizer = OmsiChunkSizer(max_chunk_size)
+        self.send_stats = OmsiSendStats()
+        self.observers = []
+
+    def clone(self):
+        client = OmsiSocketClient(
+            self.hostname,
+            self.port,
+            self.email,
+            self.exam_id,
+            self.receive_sizer.max_size,
+            self.reuse_connections,
+            self.retry_policy,
+            self.compression,
+            self.tls_context,
+            self.socket_options,
+            self.upload_limit,
+            self.download_limit,
+            self.selector,
+            self.pool_idle_time,
+            self.revalidate,
+        )
+        client.observers = self.observers
+        return client
+
+    # Points the client at another server, for the next connection it opens.
+    def use_endpoint(self, hostname, port):
+        self.hostname = hostname
+        self.port = port
+        self.server = f"{hostname}:{port}"
+        self.pool = (
+            get_connection_pool(
+                hostname,
+                port,
+                self.tls_context,
+                self.socket_options,
+                self.pool_idle_time,
+            )
+            if self.reuse_connections
+            else None
+        )
+
+    # Observers are shared with clones. Every event is guarded by a check for
+    # observers, so none registered costs nothing in the transfer loops.
+    def add_observer(self, observer: OmsiClientObserver):
+        self.observers.append(observer)
+
+    def remove_observer(self, observer: OmsiClientObserver):
+        self.observers.remove(observer)
+
+    def notify(self, event, *args):
+        for observer in self.observers:
+            getattr(observer, event)(self, *args)
 
     def is_open(self):
         return self.socket is not None
@@ -82,89 +902,731 @@ class OmsiSocketClient:
         if self.socket is not None:
             return
 
+        # With several servers, each connection goes to the best one now.
+        if self.selector is not None:
+            self.endpoint = self.selector.best()
+            self.use_endpoint(self.endpoint.hostname, self.endpoint.port)
+
+        if self.observers:
+            self.notify("connect_start")
+
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.settimeout(10)
-            self.socket.connect((self.hostname, int(self.port)))
-        except:
-            self.close()
+            started = time.monotonic()
+
+            if self.pool is not None:
+                self.socket, self.reused = self.pool.acquire()
+            else:
+                self.socket = connect_socket(
+                    self.hostname, self.port, self.tls_context, self.socket_options
+                )
+                self.reused = False
+
+            if not self.reused:
+                metrics.record("connect", self.server, time.monotonic() - started)
+
+            self.timeout = self.socket.gettimeout()
+            self.exchanged = False
+            self.reader.reset()
+            self.receive_sizer.limit_to_socket(self.socket, socket.SO_RCVBUF)
+            self.send_sizer.limit_to_socket(self.socket, socket.SO_SNDBUF)
+        except BaseException as e:
+            self.discard()
+
+            if self.endpoint is not None and isinstance(e, OSError):
+                self.selector.mark_failed(self.endpoint)
+
+            if self.observers:
+                self.notify("connect_end", False, e)
+
             raise
 
+        if self.observers:
+            self.notify("connect_end", self.reused)
+
+    def frame_writer(self):
+        return OmsiFrameWriter(
+            self.socket,
+            self.send_stats,
+            self.send_sizer,
+            (lambda size: self.notify("bytes_sent", size)) if self.observers else None,
+            self.upload_limit,
+        )
+
+    def timed(self, operation, function):
+        with metrics.timer(operation, self.server):
+            return function()
+
+    # A socket has a single timeout, so it is switched whenever an exchange
+    # changes direction. Sockets are left with the read timeout.
+    def set_timeout(self, timeout):
+        if self.timeout != timeout:
+            self.socket.settimeout(timeout)
+            self.timeout = timeout
+
+    # Hands a healthy connection back to the pool, if there is one.
     def close(self):
+        if self.socket:
+            remember_tls_session(
+                self.socket, self.tls_context, self.hostname, self.port
+            )
+
+        if self.socket and self.pool is not None:
+            self.pool.release(self.socket)
+        elif self.socket:
+            self.socket.close()
+
+        if self.socket and self.observers:
+            self.notify("close")
+
+        self.socket = None
+
+    # Closes the connection outright, for when its state is unknown.
+    def discard(self):
         if self.socket:
             self.socket.close()
 
+        if self.socket and self.observers:
+            self.notify("close")
+
         self.socket = None
 
-    def receive_response(self):
-        return self.socket.recv(SOCKET_CHUNK_SIZE).decode("utf-8")
+    # The server the next connection will go to.
+    def next_server(self):
+        if self.socket is None and self.selector is not None:
+            return str(self.selector.best())
 
-    def receive_file(self):
-        buffer = io.BytesIO()
+        return self.server
 
+    def run_with_retry(self, operation, max_tries=None):
+        return self.retry_policy.run(
+            operation,
+            max_tries,
+            (lambda *args: self.notify("retry", *args)) if self.observers else None,
+            self.next_server,
+        )
+
+    # Runs a single request/response exchange on an open connection. A pooled
+    # connection the server dropped while idle fails before the server says
+    # anything, in which case the operation is replayed on another one.
+    # Otherwise the server is marked as failed, so that with several servers
+    # the retry goes to another one.
+    def run_operation(self, operation):
         while True:
-            chunk = self.socket.recv(SOCKET_CHUNK_SIZE)
+            self.open()
+            reused = self.reused
 
-            if chunk[-1] == 0:
-                buffer.write(chunk[:-1])
-                break
+            try:
+                result = operation()
+            except OSError:
+                self.discard()
+
+                if reused and not self.exchanged:
+                    continue
+
+                if self.endpoint is not None:
+                    self.selector.mark_failed(self.endpoint)
+
+                raise
+            except:
+                self.discard()
+                raise
+
+            self.close()
+            return result
+
+    # Reads more of the reply into the reader's buffer.
+    def fill(self, size=SOCKET_CHUNK_SIZE):
+        started = time.monotonic()
+        received = self.reader.buffer.recv_into(self.socket, size)
+
+        if received == 0:
+            self.reader.closed = True
+        else:
+            self.exchanged = True
+            metrics.add("bytes_received", self.server, received)
+
+            if self.observers:
+                self.notify("bytes_received", received)
+
+            self.download_limit.consume(received)
+
+        return received, time.monotonic() - started
+
+    # Waits up to RESPONSE_SETTLE_TIME for more data, returning True if none
+    # arrived.
+    def settle(self):
+        if is_tls_socket(self.socket) and self.socket.pending():
+            return False
+
+        readable, _, _ = select.select([self.socket], [], [], RESPONSE_SETTLE_TIME)
+        return not readable
+
+    # Replies are NUL-terminated, but a server may leave the last one of an
+    # exchange unterminated. One of the expected replies is recognised as soon
+    # as it has arrived. Without any, as for the free-text reply to an upload,
+    # an unterminated reply only counts as complete once the server hangs up
+    # or has been quiet for RESPONSE_SETTLE_TIME, which that exchange then
+    # pays in latency.
+    def receive_response(self, expected=()):
+        settled = False
+
+        while True:
+            response = self.reader.next_message(expected, settled)
+
+            if response is not None:
+                if self.observers:
+                    self.notify("response_received", response)
+
+                return response
+
+            if self.reader.buffer.length and not expected:
+                settled = self.settle()
+
+                if settled:
+                    continue
+
+            self.fill()
 
-            buffer.write(chunk)
+    # Without a sink, the returned buffer is reused by the next receive, so
+    # callers must consume it before receiving again. With a sink, every chunk
+    # is written through as it arrives and the sink is returned.
+    # Unlike replies, the file may itself contain NULs, so it only ends at a
+    # NUL that is the last byte received so far.
+    def receive_file(self, sink=None):
+        buffer = self.reader.buffer
+        pending = buffer.length
 
-        return buffer
+        while True:
+            if pending:
+                received, pending = pending, 0
+            else:
+                if sink is not None:
+                    buffer.reset()
+
+                size = self.receive_sizer.size
+                received, elapsed = self.fill(size)
+                self.receive_sizer.update(size, received, elapsed)
+
+            # A hang-up before the NUL leaves the file incomplete.
+            if received == 0:
+                raise ConnectionResetError("Server closed the connection")
+
+            done = buffer.last_byte() == 0
+
+            if done:
+                buffer.truncate(buffer.length - 1)
+
+            if sink is not None:
+                sink.write(buffer.getbuffer())
+
+            if done:
+                break
+
+        return buffer if sink is None else sink
 
     def send_command(self, command):
-        self.socket.send(command.encode())
-
-    def get_exam_questions(self):
-        self.open()
-        self.send_command(COMMAND_GET_QUESTIONS)
-        bytes = self.receive_file()
-        self.close()
-        return bytes
-
-    def get_supp_file(self):
-        self.open()
-        self.send_command(COMMAND_GET_SUPP)
-        bytes = self.receive_file()
-        self.close()
-        return bytes
-
-    def send_file(self, file_name, file_bytes: io.IOBase = None):
-        self.send_command(
-            f"OMSI0001\0{file_name}\0{self.email}\0{VERSION}{self.exam_id}"
+        data = command.encode()
+        self.set_timeout(self.socket_options.write_timeout)
+        self.frame_writer().write([data])
+        self.set_timeout(self.socket_options.read_timeout)
+        metrics.add("bytes_sent", self.server, len(data))
+
+    def request_file(self, command, sink=None):
+        if sink is not None:
+            sink.reset()
+
+        self.send_command(command)
+        return self.receive_file(sink)
+
+    def receive_header(self, field_count):
+        while True:
+            fields = self.reader.next_fields(field_count)
+
+            if fields is not None:
+                return fields
+
+            self.fill()
+
+    # Sends a request using a protocol extension and reads the reply header.
+    # Silence, a hang-up or an unexpected reply means the server does not
+    # support the extension, unless a stale pooled connection is to blame.
+    def request_extension(self, command, field_count, replies):
+        self.send_command(command)
+
+        try:
+            self.set_timeout(EXTENSION_NEGOTIATE_TIMEOUT)
+            fields = self.receive_header(field_count)
+        except OSError as e:
+            if self.reused and not self.exchanged:
+                raise
+
+            raise OmsiExtensionUnsupportedError(e) from e
+        finally:
+            self.set_timeout(self.socket_options.read_timeout)
+
+        if fields[0] not in replies:
+            raise OmsiExtensionUnsupportedError("Server sent an unknown reply")
+
+        return fields
+
+    def run_extension(self, extension, operation):
+        key = (self.hostname, int(self.port), extension)
+
+        if not extension_support.get(key, True):
+            raise OmsiExtensionUnsupportedError(f"Server does not support {extension}")
+
+        try:
+            result = self.run_with_retry(lambda: self.run_operation(operation))
+        except OmsiExtensionUnsupportedError:
+            extension_support[key] = False
+            raise
+
+        extension_support[key] = True
+        return result
+
+    def request_compressed_file(self, command, sink=None):
+        if sink is not None:
+            sink.reset()
+
+        fields = self.request_extension(
+            f"{COMMAND_COMPRESSED}\0{command}\0{','.join(TRANSFER_ENCODINGS)}",
+            3,
+            [RESPONSE_COMPRESSED],
+        )
+        _, encoding, remaining = fields
+
+        if encoding != TRANSFER_IDENTITY and encoding not in TRANSFER_ENCODINGS:
+            raise OmsiExtensionUnsupportedError(f"Unknown encoding {encoding}")
+
+        try:
+            remaining = int(remaining)
+        except ValueError as e:
+            raise OmsiExtensionUnsupportedError(e) from e
+
+        output = sink if sink is not None else io.BytesIO()
+        decompressor = TRANSFER_ENCODINGS.get(encoding, lambda: None)()
+        buffer = self.reader.buffer
+
+        while remaining:
+            if buffer.length == 0 and self.fill(self.receive_sizer.size)[0] == 0:
+                raise ConnectionResetError("Server closed the connection")
+
+            with buffer.getbuffer() as view:
+                with view[:remaining] as payload:
+                    size = len(payload)
+
+                    if decompressor is None:
+                        output.write(payload)
+                    else:
+                        output.write(decompressor.decompress(payload))
+
+            buffer.consume(size)
+            remaining -= size
+
+        if hasattr(decompressor, "flush"):
+            output.write(decompressor.flush())
+
+        return output
+
+    def fetch_file(self, command, sink=None):
+        if self.compression:
+            try:
+                return self.run_extension(
+                    COMMAND_COMPRESSED,
+                    lambda: self.timed(
+                        "download", lambda: self.request_compressed_file(command, sink)
+                    ),
+                )
+            except OmsiExtensionUnsupportedError:
+                pass
+
+        return self.run_with_retry(
+            lambda: self.run_operation(
+                lambda: self.timed("download", lambda: self.request_file(command, sink))
+            )
+        )
+
+    def request_file_if_changed(self, command, digest, sink):
+        sink.reset()
+
+        (reply,) = self.request_extension(
+            f"{COMMAND_IF_CHANGED}\0{command}\0{digest}",
+            1,
+            [RESPONSE_MODIFIED, RESPONSE_NOT_MODIFIED],
         )
 
-        if self.receive_response() != RESPONSE_ACCEPT_READY:
+        if reply == RESPONSE_NOT_MODIFIED:
+            return False
+
+        self.receive_file(sink)
+        return True
+
+    # Downloads file into the exam directory unless the copy already there is
+    # younger than max_age seconds or, with revalidate, the server confirms it
+    # is unchanged.
+    # Downloaded bytes are also written to observer as they arrive.
+    def fetch_cached_file(
+        self, command, data: OmsiDataManager, file, max_age=0, observer=None
+    ):
+        cached = data.cached_file(file)
+
+        if cached is not None and time.time() - cached[1] < max_age:
+            return data.file_path(file)
+
+        with data.file_sink(file) as sink:
+            target = sink if observer is None else OmsiTeeSink(sink, observer)
+            changed = None
+
+            if cached is not None and self.revalidate:
+                try:
+                    changed = self.run_extension(
+                        COMMAND_IF_CHANGED,
+                        lambda: self.timed(
+                            "revalidate",
+                            lambda: self.request_file_if_changed(
+                                command, cached[0], target
+                            ),
+                        ),
+                    )
+                except OmsiExtensionUnsupportedError:
+                    pass
+
+            if changed is None:
+                self.fetch_file(command, target)
+            elif not changed:
+                sink.abort()
+
+        data.record_cached_file(
+            file, cached[0] if changed is False else sink.hexdigest()
+        )
+        return data.file_path(file)
+
+    def get_exam_questions(self, sink=None):
+        return self.fetch_file(COMMAND_GET_QUESTIONS, sink)
+
+    def get_supp_file(self, sink=None):
+        return self.fetch_file(COMMAND_GET_SUPP, sink)
+
+    def send_source(self, source: OmsiUploadSource):
+        self.set_timeout(self.socket_options.write_timeout)
+
+        if source.path is None:
+            self.frame_writer().write([source.data])
+        elif self.upload_limit.is_limited():
+            # sendfile cannot be paced.
+            writer = self.frame_writer()
+
+            for chunk in source.chunks(self.send_sizer.size):
+                writer.write([chunk])
+        else:
+            with open(source.path, "rb") as f:
+                # sendfile loops internally, so only the byte count is known.
+                sent = self.socket.sendfile(f)
+                self.send_stats.bytes_sent += sent
+                self.send_stats.syscalls += 1
+
+                if self.observers:
+                    self.notify("bytes_sent", sent)
+
+        self.set_timeout(self.socket_options.read_timeout)
+        metrics.add("bytes_sent", self.server, source.size)
+
+    def send_file(self, file_name, file_bytes: io.IOBase = None, file_path=None):
+        source = OmsiUploadSource.create(file_bytes, file_path)
+        self.send_stats = OmsiSendStats()
+
+        with metrics.timer("handshake", self.server):
+            self.send_command(
+                f"OMSI0001\0{file_name}\0{self.email}\0{VERSION}{self.exam_id}"
+            )
+            response = self.receive_response([RESPONSE_ACCEPT_READY])
+
+        if response != RESPONSE_ACCEPT_READY:
             print("Server client desync")
+            self.discard()
+            return
+
+        with metrics.timer("upload", self.server):
+            self.send_source(source)
+            return self.receive_response()
+
+    def send_file_with_retry(
+        self, file_name, file_bytes: io.IOBase = None, max_tries=None, file_path=None
+    ):
+        try:
+            source = OmsiUploadSource.create(file_bytes, file_path)
+
+            # Recorded against the server that took the upload in the end.
+            with metrics.timer("submit", lambda: self.server):
+                return self.run_with_retry(
+                    lambda: self.run_operation(
+                        lambda: self.send_file(file_name, source)
+                    ),
+                    max_tries,
+                )
+        except socket.error as e:
+            return e
+
+    # Uploads (file name, OmsiUploadSource) pairs over up to max_workers
+    # connections at once and returns (file name, response or error) pairs in
+    # order.
+    def send_files_with_retry(self, files, max_workers=BATCH_MAX_WORKERS):
+        with ThreadPoolExecutor(max(1, max_workers)) as executor:
+            results = executor.map(
+                lambda file: self.clone().send_file_with_retry(file[0], file[1]),
+                files,
+            )
+
+            return [(file[0], res) for file, res in zip(files, results)]
+
+
+# Downloads the exam questions and the supplementary file at the same time
+# over separate connections, reporting each one as soon as it is on disk.
+class OmsiSessionBootstrap:
+    def __init__(self, client: OmsiSocketClient, data: OmsiDataManager, max_age=0):
+        self.client = client
+        self.data = data
+        self.max_age = max_age
+        self.threads = []
+
+    # on_question is called with each question as soon as it has been
+    # downloaded, before on_questions reports the whole file.
+    def start(self, on_questions, on_supp, on_question=None):
+        parser = OmsiQuestionParser(on_question) if on_question else None
+
+        self.threads = [
+            self.fetch(
+                self.client,
+                COMMAND_GET_QUESTIONS,
+                EXAM_QUESTIONS_FILE,
+                on_questions,
+                parser,
+            ),
+            self.fetch(self.client.clone(), COMMAND_GET_SUPP, SUPP_FILE, on_supp),
+        ]
+
+    def fetch(self, client: OmsiSocketClient, command, file, callback, parser=None):
+        def run():
+            try:
+                path = client.fetch_cached_file(
+                    command, self.data, file, self.max_age, parser
+                )
+
+                if parser is not None:
+                    if not parser.received:
+                        # Served from the cache, nothing was streamed.
+                        with open(path, "rb") as f:
+                            parser.write(f.read())
+
+                    parser.close()
+            except Exception as e:
+                callback(e)
+                return
+
+            callback(path)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+
+class OmsiAsyncClient:
+    def __init__(
+        self,
+        hostname,
+        port,
+        email,
+        exam_id,
+        max_chunk_size=SOCKET_MAX_CHUNK_SIZE,
+        retry_policy: OmsiRetryPolicy = None,
+        tls_context=None,
+        socket_options: OmsiSocketOptions = None,
+        upload_limit: OmsiTokenBucket = None,
+        download_limit: OmsiTokenBucket = None,
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.email = email
+        self.exam_id = exam_id
+        self.tls_context = tls_context
+        self.upload_limit = upload_limit or upload_budget
+        self.download_limit = download_limit or download_budget
+        self.socket_options = socket_options or default_socket_options
+        self.server = f"{hostname}:{port}"
+        self.reader = None
+        self.writer = None
+        self.response_reader = OmsiResponseReader()
+        self.retry_policy = retry_policy or OmsiRetryPolicy()
+        self.receive_sizer = OmsiChunkSizer(max_chunk_size)
+        self.send_sizer = OmsiChunkSizer(max_chunk_size)
+
+    def is_open(self):
+        return self.writer is not None
+
+    async def open(self):
+        if self.writer is not None:
             return
 
+        self.response_reader.reset()
+
+        try:
+            with metrics.timer("connect", self.server):
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(
+                        self.hostname, int(self.port), ssl=self.tls_context
+                    ),
+                    self.socket_options.connect_timeout,
+                )
+
+            self.socket_options.apply(self.writer.get_extra_info("socket"))
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+        self.reader = None
+        self.writer = None
+
+    async def fill(self, size=SOCKET_CHUNK_SIZE, timeout=None):
+        started = time.monotonic()
+        chunk = await asyncio.wait_for(
+            self.reader.read(size), timeout or self.socket_options.read_timeout
+        )
+        elapsed = time.monotonic() - started
+        metrics.add("bytes_received", self.server, len(chunk))
+        await self.download_limit.consume_async(len(chunk))
+
+        if not chunk:
+            self.response_reader.closed = True
+
+        self.response_reader.buffer.append(chunk)
+        return len(chunk), elapsed
+
+    async def receive_response(self, expected=()):
+        settled = False
+
         while True:
-            chunk = file_bytes.read(SOCKET_CHUNK_SIZE)
+            response = self.response_reader.next_message(expected, settled)
 
-            if len(chunk) == 0:
+            if response is not None:
+                return response
+
+            if self.response_reader.buffer.length and not expected:
+                try:
+                    await self.fill(timeout=RESPONSE_SETTLE_TIME)
+                except asyncio.TimeoutError:
+                    settled = True
+
+                continue
+
+            await self.fill()
+
+    # Like OmsiSocketClient.receive_file, starting with whatever the reader
+    # already holds.
+    async def receive_file(self):
+        buffer = self.response_reader.buffer
+        pending = buffer.length
+
+        while True:
+            if pending:
+                received, pending = pending, 0
+            else:
+                size = self.receive_sizer.size
+                received, elapsed = await self.fill(size)
+                self.receive_sizer.update(size, received, elapsed)
+
+            if received == 0:
+                raise ConnectionResetError("Server closed the connection")
+
+            if buffer.last_byte() == 0:
+                buffer.truncate(buffer.length - 1)
                 break
 
-            self.socket.send(chunk)
+        file = io.BytesIO(buffer.getvalue())
+        buffer.reset()
+        return file
 
-        return self.receive_response()
+    async def send_command(self, command):
+        data = command.encode()
+        self.writer.write(data)
+        await asyncio.wait_for(self.writer.drain(), self.socket_options.write_timeout)
+        metrics.add("bytes_sent", self.server, len(data))
 
-    def send_file_with_retry(
-        self, file_name, file_bytes: io.IOBase = None, max_tries=3
-    ):
-        attempts = 0
-        err = None
-        while attempts < max_tries:
-            try:
-                if not self.is_open():
-                    self.open()
+    async def request_file(self, command):
+        try:
+            await self.open()
+
+            with metrics.timer("download", self.server):
+                await self.send_command(command)
+                return await self.receive_file()
+        finally:
+            self.close()
+
+    async def get_exam_questions(self):
+        return await self.retry_policy.run_async(
+            lambda: self.request_file(COMMAND_GET_QUESTIONS), server=lambda: self.server
+        )
+
+    async def get_supp_file(self):
+        return await self.retry_policy.run_async(
+            lambda: self.request_file(COMMAND_GET_SUPP), server=lambda: self.server
+        )
+
+    async def send_file(self, file_name, file_bytes: io.IOBase = None):
+        source = OmsiUploadSource.create(file_bytes)
+
+        with metrics.timer("handshake", self.server):
+            await self.send_command(
+                f"OMSI0001\0{file_name}\0{self.email}\0{VERSION}{self.exam_id}"
+            )
+            response = await self.receive_response([RESPONSE_ACCEPT_READY])
+
+        if response != RESPONSE_ACCEPT_READY:
+            print("Server client desync")
+            return
+
+        with metrics.timer("upload", self.server):
+            size = self.upload_limit.chunk_size(self.send_sizer.size, SOCKET_CHUNK_SIZE)
+
+            for chunk in source.chunks(size):
+                start = time.monotonic()
+                self.writer.write(chunk)
+                await asyncio.wait_for(
+                    self.writer.drain(), self.socket_options.write_timeout
+                )
+                self.send_sizer.update(len(chunk), len(chunk), time.monotonic() - start)
+                metrics.add("bytes_sent", self.server, len(chunk))
+                await self.upload_limit.consume_async(len(chunk))
 
-                return self.send_file(file_name, file_bytes)
-            except socket.error as e:
-                err = e
-            finally:
-                self.close()
+            return await self.receive_response()
 
-            attempts += 1
+    async def send_file_attempt(self, file_name, file_bytes: io.IOBase = None):
+        try:
+            if not self.is_open():
+                await self.open()
+
+            return await self.send_file(file_name, file_bytes)
+        finally:
+            self.close()
+
+    async def send_file_with_retry(
+        self, file_name, file_bytes: io.IOBase = None, max_tries=None
+    ):
+        try:
+            source = OmsiUploadSource.create(file_bytes)
 
-        return err
+            with metrics.timer("submit", self.server):
+                return await self.retry_policy.run_async(
+                    lambda: self.send_file_attempt(file_name, source),
+                    max_tries,
+                    server=lambda: self.server,
+                )
+        except (OSError, asyncio.TimeoutError) as e:
+            return e
@@ -0,0 +1,281 @@
+import errno
+import os
+import select
+import socket
+import threading
+import time
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+RESOLVER_TTL = 300
+HAPPY_EYEBALLS_DELAY = 0.25
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 10
+WRITE_TIMEOUT = 10
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+CONNECT_IN_PROGRESS = {
+    0,
+    errno.EINPROGRESS,
+    errno.EWOULDBLOCK,
+    errno.EALREADY,
+    getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK),
+}
+
+
+# How client sockets are set up. Commands and replies are small, so Nagle's
+# algorithm only delays them; keepalive probes notice a dead route while a
+# pooled connection sits idle. Buffer sizes of 0 keep the system defaults.
+# Timeouts are in seconds.
+class OmsiSocketOptions:
+    def __init__(
+        self,
+        nodelay=True,
+        keepalive=True,
+        keepalive_idle=KEEPALIVE_IDLE,
+        keepalive_interval=KEEPALIVE_INTERVAL,
+        keepalive_count=KEEPALIVE_COUNT,
+        send_buffer_size=0,
+        receive_buffer_size=0,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        write_timeout=WRITE_TIMEOUT,
+    ):
+        self.nodelay = nodelay
+        self.keepalive = keepalive
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+        self.send_buffer_size = send_buffer_size
+        self.receive_buffer_size = receive_buffer_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+
+    # Buffer sizes only affect the TCP window if set before connecting.
+    def apply(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, int(self.keepalive))
+
+        if self.keepalive:
+            self.apply_keepalive(sock)
+
+        if self.send_buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
+
+        if self.receive_buffer_size:
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size
+            )
+
+    def apply_keepalive(self, sock):
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive_idle
+            )
+        elif hasattr(socket, "TCP_KEEPALIVE"):
+            # macOS
+            sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, self.keepalive_idle
+            )
+        elif hasattr(socket, "SIO_KEEPALIVE_VALS"):
+            # Older Windows, which has no way to set the probe count.
+            sock.ioctl(
+                socket.SIO_KEEPALIVE_VALS,
+                (1, self.keepalive_idle * 1000, self.keepalive_interval * 1000),
+            )
+            return
+
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, self.keepalive_interval
+            )
+
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_KEEPCNT, self.keepalive_count
+            )
+
+
+default_socket_options = OmsiSocketOptions()
+
+
+# Keeps getaddrinfo results for RESOLVER_TTL seconds so that reconnecting to
+# the same server does not wait on DNS every time.
+class OmsiResolverCache:
+    def __init__(self, ttl=RESOLVER_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, hostname, port):
+        key = (hostname, int(port))
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        addresses = interleave_families(
+            socket.getaddrinfo(hostname, int(port), type=socket.SOCK_STREAM)
+        )
+
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, addresses)
+
+        return addresses
+
+    def invalidate(self, hostname, port):
+        with self.lock:
+            self.entries.pop((hostname, int(port)), None)
+
+
+resolver = OmsiResolverCache()
+
+# What a non-blocking read on a TLS socket raises when no data is waiting.
+TLS_WOULD_BLOCK = (
+    (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError)
+    if ssl is not None
+    else (BlockingIOError,)
+)
+tls_sessions = {}
+tls_sessions_lock = threading.Lock()
+
+
+def create_tls_context(cafile=None, verify=True):
+    if ssl is None:
+        raise RuntimeError("This Python installation was built without ssl support")
+
+    context = ssl.create_default_context(cafile=cafile)
+
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+    return context
+
+
+def is_tls_socket(sock):
+    return ssl is not None and isinstance(sock, ssl.SSLSocket)
+
+
+# Runs the TLS handshake on a connected socket, offering the last session this
+# context saw for the server so the handshake can be resumed instead of
+# repeated in full.
+def wrap_tls(sock, context, hostname, port):
+    key = (hostname, int(port), id(context))
+
+    with tls_sessions_lock:
+        session = tls_sessions.get(key)
+
+    try:
+        return context.wrap_socket(sock, server_hostname=hostname, session=session)
+    except:
+        sock.close()
+        raise
+
+
+# TLS 1.3 servers send session tickets after the handshake, so the session is
+# only worth keeping once the connection has been used.
+def remember_tls_session(sock, context, hostname, port):
+    if not is_tls_socket(sock) or sock.session is None:
+        return
+
+    with tls_sessions_lock:
+        tls_sessions[(hostname, int(port), id(context))] = sock.session
+
+
+# Alternates address families, keeping the resolver's preferred one first,
+# so an unreachable IPv6 (or IPv4) route only costs one attempt's delay.
+def interleave_families(addresses):
+    families = {}
+
+    for address in addresses:
+        families.setdefault(address[0], []).append(address)
+
+    queues = list(families.values())
+    interleaved = []
+
+    while queues:
+        for queue in queues:
+            interleaved.append(queue.pop(0))
+
+        queues = [queue for queue in queues if queue]
+
+    return interleaved
+
+
+# Happy eyeballs (RFC 8305): start connecting to the first address, start the
+# next one if nothing has connected within HAPPY_EYEBALLS_DELAY (or as soon as
+# an attempt fails), and keep whichever connects first.
+def connect_happy_eyeballs(
+    addresses, timeout, delay=HAPPY_EYEBALLS_DELAY, options: OmsiSocketOptions = None
+):
+    remaining = list(addresses)
+    pending = {}
+    deadline = time.monotonic() + timeout
+    next_start = 0
+    error = None
+
+    try:
+        while remaining or pending:
+            now = time.monotonic()
+
+            if now >= deadline:
+                raise socket.timeout("timed out")
+
+            if remaining and (not pending or now >= next_start):
+                family, type, proto, _, address = remaining.pop(0)
+                sock = socket.socket(family, type, proto)
+                sock.setblocking(False)
+
+                try:
+                    if options is not None:
+                        options.apply(sock)
+
+                    result = sock.connect_ex(address)
+                except:
+                    sock.close()
+                    raise
+
+                if result not in CONNECT_IN_PROGRESS:
+                    sock.close()
+                    error = OSError(result, os.strerror(result))
+                    continue
+
+                pending[sock] = address
+                next_start = now + delay
+                continue
+
+            wait = deadline - now
+
+            if remaining:
+                wait = min(wait, next_start - now)
+
+            _, writable, failed = select.select(
+                [], list(pending), list(pending), max(wait, 0)
+            )
+
+            for sock in set(writable) | set(failed):
+                result = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+                if result == 0:
+                    del pending[sock]
+                    return sock
+
+                del pending[sock]
+                sock.close()
+                error = OSError(result, os.strerror(result))
+                next_start = 0
+
+        raise error or OSError("No addresses to connect to")
+    finally:
+        for sock in pending:
+            sock.close()
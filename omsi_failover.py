@@ -0,0 +1,154 @@
+import threading
+import time
+
+from omsi_connect import (
+    OmsiSocketOptions,
+    connect_happy_eyeballs,
+    default_socket_options,
+    resolver,
+)
+
+PROBE_INTERVAL = 15
+PROBE_TIMEOUT = 2
+PROBE_RTT_WEIGHT = 0.3
+ENDPOINT_FAILURE_COOLDOWN = 30
+
+
+class OmsiEndpoint:
+    def __init__(self, hostname, port):
+        self.hostname = hostname
+        self.port = port
+        self.rtt = None
+        self.failed_at = None
+
+    def is_healthy(self):
+        return (
+            self.failed_at is None
+            or time.monotonic() - self.failed_at >= ENDPOINT_FAILURE_COOLDOWN
+        )
+
+    def __str__(self):
+        return f"{self.hostname}:{self.port}"
+
+
+# Splits "host1, host2:port2, [::1]:port3" into (hostname, port) pairs, using
+# default_port where none is given. Raises ValueError for a port that is not a
+# number from 1 to 65535.
+def parse_endpoints(hostnames, default_port):
+    endpoints = []
+
+    for entry in hostnames.split(","):
+        entry = entry.strip()
+
+        if not entry:
+            continue
+
+        if entry.startswith("["):
+            hostname, _, rest = entry[1:].partition("]")
+            port = rest[1:] if rest.startswith(":") else default_port
+        elif entry.count(":") == 1:
+            hostname, port = entry.split(":")
+        else:
+            hostname, port = entry, default_port
+
+        port = str(port).strip()
+
+        if not port.isdigit() or not 0 < int(port) < 65536:
+            raise ValueError(f"Invalid port {port!r} for server {entry!r}")
+
+        endpoints.append((hostname, port))
+
+    return endpoints
+
+
+# Picks which of several equivalent exam servers to talk to. Each one's
+# connect time is probed in the background and smoothed, and the fastest
+# server that has not failed within ENDPOINT_FAILURE_COOLDOWN is used.
+# Servers that have not been probed yet keep the order they were given in.
+class OmsiEndpointSelector:
+    def __init__(
+        self,
+        endpoints,
+        options: OmsiSocketOptions = None,
+        interval=PROBE_INTERVAL,
+    ):
+        self.endpoints = [OmsiEndpoint(hostname, port) for hostname, port in endpoints]
+        self.options = options or default_socket_options
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def probe(self, endpoint: OmsiEndpoint):
+        started = time.monotonic()
+
+        try:
+            sock = connect_happy_eyeballs(
+                resolver.resolve(endpoint.hostname, endpoint.port),
+                PROBE_TIMEOUT,
+                options=self.options,
+            )
+        except OSError:
+            resolver.invalidate(endpoint.hostname, endpoint.port)
+            self.mark_failed(endpoint)
+            return
+
+        rtt = time.monotonic() - started
+        sock.close()
+
+        with self.lock:
+            if endpoint.rtt is None:
+                endpoint.rtt = rtt
+            else:
+                endpoint.rtt += PROBE_RTT_WEIGHT * (rtt - endpoint.rtt)
+
+            endpoint.failed_at = None
+
+    def probe_all(self):
+        threads = [
+            threading.Thread(target=self.probe, args=(endpoint,), daemon=True)
+            for endpoint in self.endpoints
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.probe_all()
+            self.stopped.wait(self.interval)
+
+    def mark_failed(self, endpoint: OmsiEndpoint):
+        with self.lock:
+            endpoint.failed_at = time.monotonic()
+
+    # If every server has failed recently, the one that failed longest ago
+    # gets another try.
+    def best(self):
+        with self.lock:
+            healthy = [endpoint for endpoint in self.endpoints if endpoint.is_healthy()]
+
+            if not healthy:
+                return min(self.endpoints, key=lambda endpoint: endpoint.failed_at)
+
+            return min(
+                healthy,
+                key=lambda endpoint: (
+                    endpoint.rtt is None,
+                    endpoint.rtt or 0,
+                    self.endpoints.index(endpoint),
+                ),
+            )
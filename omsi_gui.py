@@ -1,22 +1,37 @@
 import PySimpleGUI as sg
 import base64
 import argparse
-import io
 import subprocess
 import time
 import os
 import random
 
-from omsi_client import OmsiSocketClient, OmsiDataManager, VERSION
+from omsi_client import (
+    OmsiConnectionWarmer,
+    OmsiSocketClient,
+    OmsiDataManager,
+    OmsiSessionBootstrap,
+    OmsiUploadSource,
+    VERSION,
+)
+from omsi_connect import create_tls_context
+from omsi_failover import OmsiEndpointSelector, parse_endpoints
+from omsi_metrics import METRICS_FILE, metrics
+from omsi_outbox import OmsiOutbox
+from omsi_ratelimit import download_budget, upload_budget
 from omsi_settings import OmsiSettings
-from omsi_utility import parse_questions
 
 WINDOW_ICON = base64.b64encode(open(r"omsi.png", "rb").read())
 SMALL_WINDOW_ICON = base64.b64encode(open(r"omsi_small.png", "rb").read())
 MATLOFF = base64.b64encode(open(r"matloff.png", "rb").read())
 
 CONNECT_END_KEY = "connect_end"
+QUESTIONS_END_KEY = "questions_end"
+QUESTION_KEY = "question"
+SUPP_END_KEY = "supp_end"
 SUBMIT_END_KEY = "submit_end"
+SUBMIT_ALL_END_KEY = "submit_all_end"
+OUTBOX_CHANGE_KEY = "outbox_change"
 
 CONFIG_FILE = "omsi_settings.ini"
 
@@ -52,6 +67,9 @@ class Omsi:
         self.combo_options = []
         self.omsi_client = None
         self.data = None
+        self.bootstrap = None
+        self.outbox = None
+        self.warmer = None
         self.connect_time = None
         self.selected_question = 0
         self.request_in_progress = False
@@ -62,6 +80,15 @@ class Omsi:
         else:
             self.settings = settings
 
+        upload_budget.configure(
+            self.settings.upload_rate_limit * 1024,
+            self.settings.rate_limit_burst * 1024,
+        )
+        download_budget.configure(
+            self.settings.download_rate_limit * 1024,
+            self.settings.rate_limit_burst * 1024,
+        )
+
         self.question_box = sg.Multiline(
             expand_y=True,
             expand_x=True,
@@ -97,11 +124,16 @@ class Omsi:
         self.button_run = sg.Button("Run", disabled=True)
         self.button_save = sg.Button("Save", disabled=True)
         self.button_submit = sg.Button("Submit", button_color="green", disabled=True)
+        self.button_submit_all = sg.Button(
+            "Submit All", button_color="green", disabled=True
+        )
 
         self.text_saved = sg.Text("Unsaved")
+        self.text_outbox = sg.Text("", visible=False)
         self.text_connected = sg.Text(
             "Connected", visible=False, expand_x=True, expand_y=True, pad=(4, 4)
         )
+        self.text_supp = sg.Text("", visible=False, expand_x=True)
 
         self.combo_question = sg.Combo(
             values=["No Session"],
@@ -127,6 +159,7 @@ class Omsi:
                         [sg.Text("Exam ID")],
                         [self.input_id],
                         [self.button_start, self.text_connected],
+                        [self.text_supp],
                     ],
                 )
             ],
@@ -161,7 +194,9 @@ class Omsi:
                             self.button_run,
                             self.button_save,
                             self.button_submit,
+                            self.button_submit_all,
                             self.text_saved,
+                            self.text_outbox,
                         ],
                         [self.answer_box],
                     ],
@@ -210,6 +245,7 @@ class Omsi:
             self.button_run.key: lambda: self.run_answer(self.selected_question),
             self.button_save.key: lambda: self.save_answer(self.selected_question),
             self.button_submit.key: lambda: self.submit_answer(self.selected_question),
+            self.button_submit_all.key: self.submit_all_start,
             self.answer_box.key: lambda: self.update_save_status(False),
         }
 
@@ -251,54 +287,163 @@ class Omsi:
         self.request_in_progress = True
 
         self.button_start.update("Connecting...", disabled=True)
+        self.text_supp.update(visible=False)
         self.input_hostname.update(disabled=True)
         self.input_port.update(disabled=True)
         self.input_email.update(disabled=True)
         self.input_id.update(disabled=True)
 
         def connect():
+            omsi_client = None
+            selector = None
+
             try:
-                omsi_client = OmsiSocketClient(hostname, port, email, id)
-                omsi_client.open()
+                # Several equivalent servers can be given, separated by commas.
+                endpoints = parse_endpoints(hostname, port) or [(hostname, port)]
+                tls_context = (
+                    create_tls_context(self.settings.tls_cafile or None)
+                    if self.settings.tls
+                    else None
+                )
+
+                if len(endpoints) > 1:
+                    selector = OmsiEndpointSelector(
+                        endpoints, self.settings.socket_options
+                    )
+                    selector.probe_all()
+                    selector.start()
+
+                omsi_client = OmsiSocketClient(
+                    *endpoints[0],
+                    email,
+                    id,
+                    reuse_connections=self.settings.reuse_connections,
+                    compression=self.settings.compression,
+                    tls_context=tls_context,
+                    socket_options=self.settings.socket_options,
+                    selector=selector,
+                    pool_idle_time=self.settings.pool_idle_time,
+                    revalidate=self.settings.revalidate_downloads,
+                )
+
+                if selector is not None:
+                    # Each failed attempt moves on to the next server.
+                    omsi_client.run_with_retry(omsi_client.open)
+                else:
+                    omsi_client.open()
+
                 return omsi_client
             except Exception as e:
-                omsi_client.close()
+                if selector is not None:
+                    selector.stop()
+
+                if omsi_client is not None:
+                    omsi_client.close()
+
                 return e
 
         self.window.perform_long_operation(connect, CONNECT_END_KEY)
 
-    def connect_end(self, res):
+    def connect_failed(self, message):
         self.request_in_progress = False
         self.button_start.update("Start", disabled=False)
+        self.input_hostname.update(disabled=False)
+        self.input_port.update(disabled=False)
+        self.input_email.update(disabled=False)
+        self.input_id.update(disabled=False)
+        self.show_error(message)
 
+    def connect_end(self, res):
         if isinstance(res, Exception):
-            self.input_hostname.update(disabled=False)
-            self.input_port.update(disabled=False)
-            self.input_email.update(disabled=False)
-            self.input_id.update(disabled=False)
-            self.show_error(f"Failed to open connection to server:\n{res}")
+            self.connect_failed(f"Failed to open connection to server:\n{res}")
             return
 
+        self.button_start.update("Downloading...")
+
+        self.data = OmsiDataManager(res.exam_id)
+        self.data.create_exam_dir()
+        metrics.dump_on_exit(self.data.file_path(METRICS_FILE))
+
+        self.bootstrap = OmsiSessionBootstrap(res, self.data)
+        self.bootstrap.start(
+            lambda res: self.window.write_event_value(QUESTIONS_END_KEY, res),
+            lambda res: self.window.write_event_value(SUPP_END_KEY, res),
+            lambda question: self.window.write_event_value(QUESTION_KEY, question),
+        )
+
+    # The exam starts as soon as the first question has been parsed; the rest
+    # are added to the question list while the download continues.
+    def start_exam(self):
+        self.request_in_progress = False
+        self.button_start.update("Start", disabled=False)
+
         self.connect_time = time.time()
-        self.omsi_client = res
+        self.omsi_client = self.bootstrap.client
 
         self.button_start.update(visible=False)
         self.text_connected.update(visible=True)
 
-        self.data = OmsiDataManager(self.omsi_client.exam_id)
-        self.data.create_exam_dir()
-        self.data.write_questions(self.omsi_client.get_exam_questions())
-        # self.data.write_supp(self.omsi_client.get_supp_file())
-        self.questions = parse_questions(self.data.questions_path())
+        self.outbox = OmsiOutbox(
+            self.omsi_client.clone(),
+            self.data,
+            lambda file_name, res: self.window.write_event_value(
+                SUBMIT_END_KEY, (file_name, res)
+            ),
+            lambda count: self.window.write_event_value(OUTBOX_CHANGE_KEY, count),
+        )
+        self.outbox.start()
+        self.update_outbox_status(self.outbox.pending_count())
+
+        # A standby connection is only of use if connections are reused.
+        if self.settings.standby_connection and self.omsi_client.reuse_connections:
+            self.warmer = OmsiConnectionWarmer(self.omsi_client)
+            self.warmer.start()
+
+    def question_received(self, question):
+        if not self.is_in_exam():
+            self.start_exam()
+
+        # A retried download parses the questions again from the start.
+        if question.get_question_number() < len(self.questions):
+            return
+
+        self.questions.append(question)
 
         self.combo_options = [
             "Exam Information",
             *[f"Question {x}" for x in range(1, len(self.questions))],
         ]
 
-        self.combo_question.update(values=self.combo_options)
+        self.combo_question.update(
+            values=self.combo_options,
+            value=self.combo_options[self.selected_question],
+        )
+
+        if len(self.questions) == 1:
+            self.select_question(0)
+
+    def questions_end(self, res):
+        if not self.is_in_exam():
+            if not isinstance(res, Exception):
+                res = "No questions found"
+
+            self.end_session()
+            self.connect_failed(f"Failed to download exam questions:\n{res}")
+            return
+
+        # Submit All uses the same connection as the download.
+        self.button_submit_all.update(disabled=False)
+
+        if isinstance(res, Exception):
+            self.show_error(f"Failed to download all exam questions:\n{res}")
+
+    def supp_end(self, res):
+        if isinstance(res, Exception):
+            self.text_supp.update("Supp file missing", visible=True)
+            self.show_error(f"Failed to download supplementary file:\n{res}")
+            return
 
-        self.select_question(0)
+        self.text_supp.update("Supp file ready", visible=True)
 
     def show_about(self):
         about_layout = [
@@ -354,6 +499,10 @@ class Omsi:
             [x for x in range(4, 32)],
             self.settings.font_size,
         )
+        submit_concurrency_input = sg.Spin(
+            [x for x in range(1, 17)],
+            self.settings.submit_concurrency,
+        )
 
         layout = [
             [
@@ -396,7 +545,11 @@ This will open the PDF using the default PDF viewer on your system."""
                         [
                             sg.Text("Editor Font Size"),
                             font_size_input,
-                        ]
+                        ],
+                        [
+                            sg.Text("Parallel Uploads"),
+                            submit_concurrency_input,
+                        ],
                     ],
                 )
             ],
@@ -416,6 +569,7 @@ This will open the PDF using the default PDF viewer on your system."""
             self.settings.pdf_reader_path = pdf_reader_input.get().strip()
             self.settings.pdf_path = pdf_input.get().strip()
             self.settings.font_size = font_size_input.get()
+            self.settings.submit_concurrency = submit_concurrency_input.get()
 
             self.answer_box.update(font=("Courier New", self.settings.font_size))
             self.question_box.update(font=("Courier New", self.settings.font_size))
@@ -460,8 +614,19 @@ This will open the PDF using the default PDF viewer on your system."""
         event, value = exit_confirm.read(close=True)
 
         if event == "Exit":
+            self.end_session()
             exit()
 
+    # Stops the background threads that keep talking to the server.
+    def end_session(self):
+        if self.warmer is not None:
+            self.warmer.stop()
+
+        # The bootstrap's client is the session's, and exists before the
+        # exam has started.
+        if self.bootstrap is not None and self.bootstrap.client.selector is not None:
+            self.bootstrap.client.selector.stop()
+
     def start_session(self):
         hostname = self.input_hostname.get()
         port = self.input_port.get()
@@ -476,6 +641,13 @@ This will open the PDF using the default PDF viewer on your system."""
             self.show_error("Port is not valid.")
             return
 
+        # Ports can also be given with each server in the hostname field.
+        try:
+            parse_endpoints(hostname, port)
+        except ValueError as e:
+            self.show_error(str(e))
+            return
+
         self.connect_start(hostname, port, email, id)
 
     def select_question(self, index):
@@ -502,43 +674,140 @@ This will open the PDF using the default PDF viewer on your system."""
         self.update_save_status()
 
     def submit_answer_start(self, index):
+        self.outbox.enqueue(
+            self.data.answer_file_name(self.questions[index]),
+            self.data.answer_path(self.questions[index]),
+        )
+
+    def submit_answer_end(self, res):
+        file_name, res = res
+
+        # Failed submissions stay in the outbox and are retried in the
+        # background, so they only show up in the queued count.
+        if res is None or isinstance(res, Exception):
+            print(f"Failed to submit {file_name}, will retry: {res}")
+            return
+
+        sg.popup_ok(
+            f"Server Response ({file_name}):\n" + res,
+            title="Submission Result",
+            icon=SMALL_WINDOW_ICON,
+            non_blocking=True,
+        )
+
+    def submit_all_start(self, force=False):
         if self.request_in_progress:
             return
+
+        if self.selected_question != 0:
+            self.questions[self.selected_question].set_answer(self.answer_box.get())
+
+        files = []
+        unchanged = []
+
+        for question in self.questions[1:]:
+            if not question.is_answered():
+                continue
+
+            self.data.save_answer(question)
+            question.set_saved(True)
+
+            if not force and self.data.is_submitted(question):
+                unchanged.append(self.data.answer_file_name(question))
+                continue
+
+            files.append(
+                (
+                    self.data.answer_file_name(question),
+                    OmsiUploadSource.snapshot(self.data.answer_path(question)),
+                )
+            )
+
+        self.update_save_status()
+
+        if not files and unchanged:
+            sg.popup_ok(
+                "All answers are unchanged since they were last accepted.",
+                title="Submission Results",
+                icon=SMALL_WINDOW_ICON,
+            )
+            return
+
+        if not files:
+            self.show_error("No answers written.")
+            return
+
         self.request_in_progress = True
+        self.button_submit_all.update("Submitting...", disabled=True)
 
-        self.button_submit.update("Submitting...", disabled=True)
-        self.combo_question.update(disabled=True)
+        def submit_all():
+            # Older queued copies must not reach the server after these.
+            self.outbox.withdraw({file_name for file_name, _ in files}.union(unchanged))
 
-        def submit():
-            return self.omsi_client.send_file_with_retry(
-                f"omsi_answer{self.questions[index].get_question_number()}{self.questions[index].get_filetype()}",
-                io.BytesIO(self.questions[index].get_answer().encode("utf-8")),
+            results = self.omsi_client.send_files_with_retry(
+                files, self.settings.submit_concurrency
             )
 
-        self.window.perform_long_operation(submit, SUBMIT_END_KEY)
+            sources = dict(files)
 
-    def submit_answer_end(self, res):
+            for file_name, res in results:
+                if res is not None and not isinstance(res, Exception):
+                    self.data.record_submission(file_name, sources[file_name].digest)
+
+            return results, unchanged
+
+        self.window.perform_long_operation(submit_all, SUBMIT_ALL_END_KEY)
+
+    def submit_all_end(self, batch):
+        results, unchanged = batch
         self.request_in_progress = False
+        self.button_submit_all.update("Submit All", disabled=False)
 
-        self.button_submit.update("Submit", disabled=False)
-        self.combo_question.update(disabled=False)
+        summary = []
 
-        if isinstance(res, Exception):
-            self.show_error(f"Failed to submit answer to server:\n{res}")
-            return
+        for file_name, res in results:
+            if res is None or isinstance(res, Exception):
+                self.outbox.enqueue(file_name, self.data.file_path(file_name))
+                summary.append(f"{file_name}: failed, queued for retry ({res})")
+            else:
+                summary.append(f"{file_name}: {res}")
 
-        sg.popup_ok(
-            "Server Response:\n" + res,
-            title="Submission Result",
+        for file_name in unchanged:
+            summary.append(f"{file_name}: unchanged since last accepted, skipped")
+
+        sg.popup_scrolled(
+            "\n".join(summary),
+            title="Submission Results",
+            non_blocking=True,
             icon=SMALL_WINDOW_ICON,
         )
 
-    def submit_answer(self, index):
+    def update_outbox_status(self, count):
+        self.text_outbox.update(
+            value=f"{count} queued", visible=self.is_in_exam() and count > 0
+        )
+
+    def submit_answer(self, index, force=False):
         if len(self.questions[index].get_answer()) == 0:
             self.show_error("No answer written.")
             return
 
         self.run_answer(index)
+
+        if not force and self.data.is_submitted(self.questions[index]):
+            force = (
+                sg.popup_yes_no(
+                    "This answer is unchanged since it was last accepted.\n"
+                    "Submit it again anyway?",
+                    title="Answer Unchanged",
+                    icon=SMALL_WINDOW_ICON,
+                )
+                == "Yes"
+            )
+
+            if not force:
+                return
+
         self.submit_answer_start(index)
 
     def save_answer(self, index):
@@ -588,9 +857,24 @@ This will open the PDF using the default PDF viewer on your system."""
         if event == CONNECT_END_KEY:
             self.connect_end(values[event])
 
+        if event == QUESTION_KEY:
+            self.question_received(values[event])
+
+        if event == QUESTIONS_END_KEY:
+            self.questions_end(values[event])
+
+        if event == SUPP_END_KEY:
+            self.supp_end(values[event])
+
         if event == SUBMIT_END_KEY:
             self.submit_answer_end(values[event])
 
+        if event == SUBMIT_ALL_END_KEY:
+            self.submit_all_end(values[event])
+
+        if event == OUTBOX_CHANGE_KEY:
+            self.update_outbox_status(values[event])
+
         if event in self.event_dispatch_table:
             self.event_dispatch_table[event]()
 
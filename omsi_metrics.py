@@ -0,0 +1,162 @@
+import atexit
+import json
+import threading
+import time
+
+HISTOGRAM_PRECISION_BITS = 7
+METRICS_FILE = "metrics.json"
+METRICS_PERCENTILES = (50, 90, 99, 99.9)
+
+
+# Latency histogram in the style of HdrHistogram: values are counted in
+# buckets whose width grows with the value, so every recorded value is known
+# to within 1 / 2**(precision_bits - 1) (about 1.6%) whatever its magnitude,
+# in a few hundred buckets. Values are recorded in microseconds.
+class OmsiHistogram:
+    def __init__(self, precision_bits=HISTOGRAM_PRECISION_BITS):
+        self.precision_bits = precision_bits
+        self.sub_bucket_count = 1 << precision_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def bucket_index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+
+        shift = value.bit_length() - self.precision_bits
+        return shift * self.half_count + (value >> shift)
+
+    # Highest value that falls into the bucket.
+    def bucket_value(self, index):
+        if index < self.sub_bucket_count:
+            return index
+
+        shift = index // self.half_count - 1
+        sub_bucket = index - shift * self.half_count
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value):
+        value = max(int(value), 0)
+        index = self.bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percentile):
+        if not self.count:
+            return None
+
+        target = max(1, round(self.count * percentile / 100))
+        seen = 0
+
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+
+            if seen >= target:
+                return min(self.bucket_value(index), self.max)
+
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean(),
+            "percentiles": {
+                str(percentile): self.percentile(percentile)
+                for percentile in METRICS_PERCENTILES
+            },
+        }
+
+
+# Latencies and byte counts per operation and per server, so a slow
+# submission can be traced to connecting, the server's handshake or the
+# upload itself.
+class OmsiMetrics:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.dump_path = None
+
+    def record(self, operation, server, seconds):
+        with self.lock:
+            key = (operation, server)
+
+            if key not in self.histograms:
+                self.histograms[key] = OmsiHistogram()
+
+            self.histograms[key].record(seconds * 1_000_000)
+
+    def add(self, counter, server, amount):
+        with self.lock:
+            key = (counter, server)
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    # Times the body of a with block, unless it raises. server may be a
+    # function, called when the block ends, for when the server is only known
+    # after the block has picked one.
+    def timer(self, operation, server):
+        return OmsiTimer(self, operation, server)
+
+    def histogram(self, operation, server):
+        with self.lock:
+            return self.histograms.get((operation, server))
+
+    def counter(self, counter, server):
+        with self.lock:
+            return self.counters.get((counter, server), 0)
+
+    def snapshot(self):
+        with self.lock:
+            servers = {}
+
+            for (operation, server), histogram in self.histograms.items():
+                entry = servers.setdefault(server, {"latency_us": {}, "counters": {}})
+                entry["latency_us"][operation] = histogram.summary()
+
+            for (counter, server), value in self.counters.items():
+                entry = servers.setdefault(server, {"latency_us": {}, "counters": {}})
+                entry["counters"][counter] = value
+
+            return servers
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=4)
+
+    def dump_on_exit(self, path=METRICS_FILE):
+        if self.dump_path is None:
+            atexit.register(lambda: self.dump(self.dump_path))
+
+        self.dump_path = path
+
+
+class OmsiTimer:
+    def __init__(self, metrics: OmsiMetrics, operation, server):
+        self.metrics = metrics
+        self.operation = operation
+        self.server = server
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            server = self.server() if callable(self.server) else self.server
+            self.metrics.record(self.operation, server, time.monotonic() - self.started)
+
+
+metrics = OmsiMetrics()
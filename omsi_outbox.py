@@ -0,0 +1,158 @@
+import os
+import shutil
+import threading
+
+from omsi_client import OmsiDataManager, OmsiSocketClient, OmsiUploadSource
+from omsi_retry import OmsiRetryPolicy
+
+OUTBOX_DIR = "outbox"
+OUTBOX_BASE_DELAY = 2
+OUTBOX_MAX_DELAY = 60
+
+
+# Submissions waiting to reach the server. Each one is a snapshot of the
+# answer file stored in exams/<id>/outbox as <sequence>_<file name>, so the
+# queue survives restarts and later edits do not change what gets sent.
+# A background thread sends them oldest first, backing off while the server
+# is unreachable.
+class OmsiOutbox:
+    def __init__(
+        self,
+        client: OmsiSocketClient,
+        data: OmsiDataManager,
+        on_result=None,
+        on_change=None,
+    ):
+        self.client = client
+        self.data = data
+        self.on_result = on_result or (lambda file_name, res: None)
+        self.on_change = on_change or (lambda count: None)
+        self.backoff = OmsiRetryPolicy(
+            base_delay=OUTBOX_BASE_DELAY, max_delay=OUTBOX_MAX_DELAY
+        ).backoff
+        self.lock = threading.Lock()
+        self.sent = threading.Condition(self.lock)
+        self.sending = None
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = None
+
+        os.makedirs(self.get_dir(), exist_ok=True)
+
+    def get_dir(self):
+        return self.data.file_path(OUTBOX_DIR)
+
+    def entries(self):
+        return sorted(
+            entry for entry in os.listdir(self.get_dir()) if not entry.endswith(".part")
+        )
+
+    def pending_count(self):
+        return len(self.entries())
+
+    def remove(self, entry):
+        try:
+            os.remove(os.path.join(self.get_dir(), entry))
+        except OSError:
+            pass
+
+    # Queues a copy of the file at path for upload as file_name, replacing any
+    # older submission of the same file that has not been sent yet.
+    def enqueue(self, file_name, path):
+        with self.lock:
+            entries = self.entries()
+            sequence = int(entries[-1].split("_", 1)[0]) + 1 if entries else 0
+
+            for entry in entries:
+                if entry.split("_", 1)[1] == file_name:
+                    self.remove(entry)
+
+            target = os.path.join(self.get_dir(), f"{sequence:06d}_{file_name}")
+            shutil.copyfile(path, target + ".part")
+            os.replace(target + ".part", target)
+
+        self.wakeup.set()
+        self.on_change(self.pending_count())
+
+    # Drops queued submissions of the given files, first waiting for any of
+    # them that is being sent, for when newer copies are uploaded directly.
+    def withdraw(self, file_names):
+        with self.lock:
+            while self.sending is not None and self.sending in file_names:
+                self.sent.wait()
+
+            for entry in self.entries():
+                if entry.split("_", 1)[1] in file_names:
+                    self.remove(entry)
+
+        self.on_change(self.pending_count())
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    def run(self):
+        attempt = 0
+
+        while not self.stopped:
+            with self.lock:
+                entries = self.entries()
+
+                if entries:
+                    self.sending = entries[0].split("_", 1)[1]
+
+            if not entries:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            try:
+                res = self.send(entries[0])
+            finally:
+                with self.lock:
+                    self.sending = None
+                    self.sent.notify_all()
+
+            if res is False:
+                continue
+
+            if res is None or isinstance(res, Exception):
+                self.wakeup.wait(self.backoff(attempt))
+                self.wakeup.clear()
+                attempt += 1
+                continue
+
+            attempt = 0
+            self.on_change(self.pending_count())
+
+    # Sends one queued submission and reports the result. Returns False if it
+    # was superseded by a newer one, otherwise the server's response.
+    def send(self, entry):
+        file_name = entry.split("_", 1)[1]
+        path = os.path.join(self.get_dir(), entry)
+
+        try:
+            source = OmsiUploadSource(path=path)
+        except OSError:
+            # Superseded by a newer submission since it was listed.
+            return False
+
+        res = self.client.send_file_with_retry(file_name, source)
+
+        if not os.path.exists(path):
+            # Superseded by a newer submission while it was being sent.
+            return False
+
+        if res is not None and not isinstance(res, Exception):
+            self.data.record_submission(file_name, source.digest)
+            self.remove(entry)
+
+        self.on_result(file_name, res)
+        return res
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+
+RATE_LIMIT_BURST = 256 * 1024
+RATE_LIMIT_QUANTUM = 0.02
+
+
+# Token bucket over bytes. Transfers take tokens as they go and may run the
+# bucket into debt, then wait until the debt has been repaid at rate bytes per
+# second, so a transfer that fits within the burst is never slowed down.
+# A rate of 0 disables the limit.
+class OmsiTokenBucket:
+    def __init__(self, rate=0, burst=RATE_LIMIT_BURST):
+        self.lock = threading.Lock()
+        self.configure(rate, burst)
+
+    def configure(self, rate, burst=RATE_LIMIT_BURST):
+        with self.lock:
+            self.rate = rate
+            self.burst = burst
+            self.tokens = burst
+            self.updated = time.monotonic()
+
+    def is_limited(self):
+        return self.rate > 0
+
+    # Caps a transfer's chunks at RATE_LIMIT_QUANTUM seconds' worth, so that it
+    # never goes quiet for longer than that between chunks. OMSI servers take
+    # a long enough pause in an upload to be its end.
+    def chunk_size(self, size, minimum=1):
+        if self.rate <= 0:
+            return size
+
+        return min(size, max(minimum, int(self.rate * RATE_LIMIT_QUANTUM)))
+
+    # Takes size tokens and returns how long to wait before going on.
+    def reserve(self, size):
+        if self.rate <= 0:
+            return 0
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= size
+
+            return max(0, -self.tokens / self.rate)
+
+    def consume(self, size):
+        delay = self.reserve(size)
+
+        if delay:
+            time.sleep(delay)
+
+    async def consume_async(self, size):
+        delay = self.reserve(size)
+
+        if delay:
+            await asyncio.sleep(delay)
+
+
+# Budgets shared by every client in the process, so that several uploads at
+# once (Submit All, the outbox) still stay under the limit together.
+upload_budget = OmsiTokenBucket()
+download_budget = OmsiTokenBucket()
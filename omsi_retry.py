@@ -0,0 +1,184 @@
+import asyncio
+import random
+import socket
+import threading
+import time
+
+RETRY_MAX_TRIES = 3
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8
+RETRY_DEADLINE = 60
+RETRY_MAX_EXPONENT = 16
+
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+
+# Timeouts, refused connections and resets are worth another try. Anything
+# else (bad hostname, permission errors, ...) will fail the same way again.
+RETRYABLE_ERRORS = (
+    socket.timeout,
+    asyncio.TimeoutError,
+    ConnectionRefusedError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+
+class OmsiCircuitOpenError(ConnectionError):
+    pass
+
+
+# Stops sending requests to a server after several failures in a row. Once
+# reset_timeout has passed every request is let through again, not just a
+# single trial, and the next failure opens the breaker for another
+# reset_timeout.
+class OmsiCircuitBreaker:
+    def __init__(
+        self,
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=BREAKER_RESET_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        with self.lock:
+            return (
+                self.opened_at is not None
+                and time.monotonic() - self.opened_at < self.reset_timeout
+            )
+
+    def check(self):
+        if self.is_open():
+            raise OmsiCircuitOpenError(
+                "Server is not responding, not retrying for "
+                f"{self.reset_timeout} seconds"
+            )
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class OmsiRetryPolicy:
+    def __init__(
+        self,
+        max_tries=RETRY_MAX_TRIES,
+        base_delay=RETRY_BASE_DELAY,
+        max_delay=RETRY_MAX_DELAY,
+        deadline=RETRY_DEADLINE,
+        retry_on=RETRYABLE_ERRORS,
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=BREAKER_RESET_TIMEOUT,
+    ):
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_on = retry_on
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self.breakers_lock = threading.Lock()
+
+    # Each server has its own breaker, so one that is down does not stop
+    # requests to the others.
+    def breaker(self, server):
+        with self.breakers_lock:
+            if server not in self.breakers:
+                self.breakers[server] = OmsiCircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+
+            return self.breakers[server]
+
+    def is_retryable(self, error):
+        return isinstance(error, self.retry_on)
+
+    # Full jitter: sleep anywhere between zero and the exponential backoff, so
+    # a whole class retrying at once spreads out instead of arriving together.
+    def backoff(self, attempt):
+        exponent = min(attempt, RETRY_MAX_EXPONENT)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**exponent))
+
+    # Returns the delay before the next attempt, or None to give up.
+    def next_delay(self, error, attempt, max_tries, started):
+        if not self.is_retryable(error) or attempt + 1 >= max_tries:
+            return None
+
+        delay = self.backoff(attempt)
+
+        if time.monotonic() + delay - started > self.deadline:
+            return None
+
+        return delay
+
+    # on_retry(attempt, error, delay) is called before each retry. server()
+    # names the server the next attempt goes to, for its breaker.
+    def run(self, operation, max_tries=None, on_retry=None, server=None):
+        max_tries = max_tries or self.max_tries
+        started = time.monotonic()
+        attempt = 0
+
+        while True:
+            breaker = self.breaker(server() if server is not None else None)
+            breaker.check()
+
+            try:
+                result = operation()
+            except OSError as e:
+                breaker.record_failure()
+                delay = self.next_delay(e, attempt, max_tries, started)
+
+                if delay is None:
+                    raise
+
+                if on_retry is not None:
+                    on_retry(attempt, e, delay)
+
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            breaker.record_success()
+            return result
+
+    async def run_async(self, operation, max_tries=None, on_retry=None, server=None):
+        max_tries = max_tries or self.max_tries
+        started = time.monotonic()
+        attempt = 0
+
+        while True:
+            breaker = self.breaker(server() if server is not None else None)
+            breaker.check()
+
+            try:
+                result = await operation()
+            except (OSError, asyncio.TimeoutError) as e:
+                breaker.record_failure()
+                delay = self.next_delay(e, attempt, max_tries, started)
+
+                if delay is None:
+                    raise
+
+                if on_retry is not None:
+                    on_retry(attempt, e, delay)
+
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            breaker.record_success()
+            return result
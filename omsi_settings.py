@@ -1,6 +1,8 @@
 import configparser
 import configparser
 
+from omsi_connect import OmsiSocketOptions
+
 
 class OmsiSettings:
     def __init__(
@@ -9,11 +11,47 @@ class OmsiSettings:
         pdf_reader_path="",
         pdf_path="",
         font_size=14,
+        submit_concurrency=4,
+        socket_options: OmsiSocketOptions = None,
+        upload_rate_limit=0,
+        download_rate_limit=0,
+        rate_limit_burst=256,
+        reuse_connections=False,
+        standby_connection=False,
+        pool_idle_time=20,
+        revalidate_downloads=False,
+        compression=False,
+        tls=False,
+        tls_cafile="",
     ):
         self.r_path = r_path
         self.pdf_reader_path = pdf_reader_path
         self.pdf_path = pdf_path
         self.font_size = font_size
+        self.submit_concurrency = submit_concurrency
+        self.socket_options = socket_options or OmsiSocketOptions()
+        # In KiB/s, 0 for no limit.
+        self.upload_rate_limit = upload_rate_limit
+        self.download_rate_limit = download_rate_limit
+        self.rate_limit_burst = rate_limit_burst
+        # Off by default, as the server may only serve one request per
+        # connection.
+        self.reuse_connections = reuse_connections
+        # Keeping a standby connection open costs the server a new connection
+        # every pool_idle_time - 5 seconds per student.
+        self.standby_connection = standby_connection
+        # Seconds an idle connection is kept for reuse.
+        self.pool_idle_time = pool_idle_time
+        # Only for servers that answer ClientWantsIfChanged, others cost a
+        # read timeout per file.
+        self.revalidate_downloads = revalidate_downloads
+        # Asks for compressed downloads. A server without the extension costs
+        # one read timeout before it is remembered as a legacy server.
+        self.compression = compression
+        # For servers behind TLS. tls_cafile is a certificate bundle to trust
+        # instead of the system's, such as a course's self-signed certificate.
+        self.tls = tls
+        self.tls_cafile = tls_cafile
 
     def save(self, filename):
         config = configparser.ConfigParser()
@@ -22,6 +60,31 @@ class OmsiSettings:
             "pdf_reader_path": self.pdf_reader_path,
             "pdf_path": self.pdf_path,
             "font_size": self.font_size,
+            "submit_concurrency": self.submit_concurrency,
+        }
+
+        s = self.socket_options
+        config["Network"] = {
+            "tcp_nodelay": s.nodelay,
+            "tcp_keepalive": s.keepalive,
+            "keepalive_idle": s.keepalive_idle,
+            "keepalive_interval": s.keepalive_interval,
+            "keepalive_count": s.keepalive_count,
+            "send_buffer_size": s.send_buffer_size,
+            "receive_buffer_size": s.receive_buffer_size,
+            "connect_timeout": s.connect_timeout,
+            "read_timeout": s.read_timeout,
+            "write_timeout": s.write_timeout,
+            "upload_rate_limit": self.upload_rate_limit,
+            "download_rate_limit": self.download_rate_limit,
+            "rate_limit_burst": self.rate_limit_burst,
+            "reuse_connections": self.reuse_connections,
+            "standby_connection": self.standby_connection,
+            "pool_idle_time": self.pool_idle_time,
+            "revalidate_downloads": self.revalidate_downloads,
+            "compression": self.compression,
+            "tls": self.tls,
+            "tls_cafile": self.tls_cafile,
         }
 
         with open(filename, "w") as f:
@@ -39,5 +102,60 @@ class OmsiSettings:
         pdf_reader_path = o["pdf_reader_Path"]
         pdf_path = o["pdf_path"]
         font_size = o["font_size"]
+        submit_concurrency = int(o.get("submit_concurrency", 4))
+
+        # Settings files from older versions have no Network section.
+        d = OmsiSocketOptions()
+        socket_options = OmsiSocketOptions(
+            config.getboolean("Network", "tcp_nodelay", fallback=d.nodelay),
+            config.getboolean("Network", "tcp_keepalive", fallback=d.keepalive),
+            config.getint("Network", "keepalive_idle", fallback=d.keepalive_idle),
+            config.getint(
+                "Network", "keepalive_interval", fallback=d.keepalive_interval
+            ),
+            config.getint("Network", "keepalive_count", fallback=d.keepalive_count),
+            config.getint("Network", "send_buffer_size", fallback=d.send_buffer_size),
+            config.getint(
+                "Network", "receive_buffer_size", fallback=d.receive_buffer_size
+            ),
+            config.getfloat("Network", "connect_timeout", fallback=d.connect_timeout),
+            config.getfloat("Network", "read_timeout", fallback=d.read_timeout),
+            config.getfloat("Network", "write_timeout", fallback=d.write_timeout),
+        )
+        upload_rate_limit = config.getint("Network", "upload_rate_limit", fallback=0)
+        download_rate_limit = config.getint(
+            "Network", "download_rate_limit", fallback=0
+        )
+        rate_limit_burst = config.getint("Network", "rate_limit_burst", fallback=256)
+        reuse_connections = config.getboolean(
+            "Network", "reuse_connections", fallback=False
+        )
+        standby_connection = config.getboolean(
+            "Network", "standby_connection", fallback=False
+        )
+        pool_idle_time = config.getfloat("Network", "pool_idle_time", fallback=20)
+        revalidate_downloads = config.getboolean(
+            "Network", "revalidate_downloads", fallback=False
+        )
+        compression = config.getboolean("Network", "compression", fallback=False)
+        tls = config.getboolean("Network", "tls", fallback=False)
+        tls_cafile = config.get("Network", "tls_cafile", fallback="")
 
-        return OmsiSettings(r_path, pdf_reader_path, pdf_path, font_size)
+        return OmsiSettings(
+            r_path,
+            pdf_reader_path,
+            pdf_path,
+            font_size,
+            submit_concurrency,
+            socket_options,
+            upload_rate_limit,
+            download_rate_limit,
+            rate_limit_burst,
+            reuse_connections,
+            standby_connection,
+            pool_idle_time,
+            revalidate_downloads,
+            compression,
+            tls,
+            tls_cafile,
+        )
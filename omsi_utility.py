@@ -1,5 +1,9 @@
+import codecs
+import io
 import shlex
 
+DEFAULT_ANSWER = "Write your answer here..."
+
 
 class OmsiQuestion:
     def __init__(
@@ -15,7 +19,7 @@ class OmsiQuestion:
     ):
         self.number = number
         self.filetype = filetype
-        self.answer = "Write your answer here..."
+        self.answer = DEFAULT_ANSWER
         self.question = question
         self.flags = flags
         self.compile_program = compile_program
@@ -39,6 +43,9 @@ class OmsiQuestion:
     def set_answer(self, ans):
         self.answer = ans
 
+    def is_answered(self):
+        return self.answer.strip() != "" and self.answer != DEFAULT_ANSWER
+
     def get_flags(self):
         return self.flags.split(" ")
 
@@ -61,84 +68,123 @@ class OmsiQuestion:
         self.was_saved = saved
 
 
+def parse_question_flags(line):
+    filetype = ".txt"
+    flags = ""
+    words = shlex.split(line)
+    compileProgram = "n"
+    compiler = ""
+    runProgram = "n"
+    runCmd = ""
+
+    for i in range(len(words)):
+        if words[i] == "-ext":
+            if i + 1 >= len(words):
+                print("Error! Unexpected end of arguments...")
+            else:
+                print(("Setting type to {0}".format(words[i + 1])))
+                filetype = words[i + 1]
+            i += 1
+        if words[i] == "-flags":
+            if i + 1 >= len(words):
+                print("Error! Unexpected end of arguments...")
+            else:
+                fl = words[i + 1]
+                print(("Setting flags to {0}".format(fl)))
+                flags = fl
+        if words[i] == "-com":  # check if question can be compiled
+            if i + 1 >= len(words):
+                print("Error! Unexpected end of arguments...")
+            else:
+                com = words[i + 1]
+                print(("Setting compiler option to {0}".format(com)))
+                compileProgram = "y"
+                compiler = com
+        if words[i] == "-run":  # check if question can be run
+            if i + 1 >= len(words):
+                print("Error! Unexpected end of arguments...")
+            else:
+                runCmd = words[i + 1]
+                runProgram = "y"
+                print(("Setting run-command option to {0}".format(runCmd)))
+                runCmd = runCmd
+
+    return filetype, flags, compileProgram, compiler, runProgram, runCmd
+
+
+# Incremental version of the question file parser from the original client:
 # https://github.com/matloff/omsi/blob/e6ee56bfc61613e3cf7655c8fcba14d2e21e172c/OmsiUtility.py#L7
+# Bytes can be written to it as they are downloaded, and each question is
+# passed to on_question as soon as the line starting the next one arrives.
+class OmsiQuestionParser:
+    def __init__(self, on_question=None):
+        self.on_question = on_question or (lambda question: None)
+        self.reset()
+
+    def reset(self):
+        self.decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder("utf-8")(errors="replace"), translate=True
+        )
+        self.partial = ""
+        self.header = None
+        self.question = ""
+        self.questions = []
+        self.received = False
+
+    def write(self, data):
+        self.received = True
+        self.feed_text(self.decoder.decode(bytes(data)))
+
+    # Lines end at "\n" only, as when reading the file in text mode;
+    # str.splitlines would also split on form feeds, "\x1c" and the like.
+    def feed_text(self, text):
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+
+        for line in lines:
+            self.feed_line(line + "\n")
+
+    def feed_line(self, line):
+        if "DESCRIPTION" in line or "QUESTION" in line:
+            self.end_question()
+            self.header = line
+        elif self.header is not None:
+            self.question += line
+
+    def end_question(self):
+        if self.header is None:
+            return
+
+        if "DESCRIPTION" in self.header:
+            q = OmsiQuestion(self.question, 0)
+        else:
+            q = OmsiQuestion(
+                self.question,
+                len(self.questions),
+                *parse_question_flags(self.header),
+            )
+
+        self.questions.append(q)
+        self.header = None
+        self.question = ""
+        self.on_question(q)
+
+    def close(self):
+        self.feed_text(self.decoder.decode(b"", final=True))
+
+        if self.partial:
+            self.feed_line(self.partial)
+            self.partial = ""
+
+        self.end_question()
+        return self.questions
+
+
 def parse_questions(filename):
+    parser = OmsiQuestionParser()
+
     with open(filename, "r") as f:
-        foundDescription = False
-        firstQuestion = False
-
-        question = ""
-        questions = []
-        line = f.readline()
-        while line:
-            if "DESCRIPTION" in line:
-                foundDescription = True
-                line = f.readline()
-                while line and "DESCRIPTION" not in line and "QUESTION" not in line:
-                    question += line
-                    line = f.readline()
-                q = OmsiQuestion(question, 0)
-                questions.append(q)
-                question = ""
-            elif "QUESTION" in line:
-                firstQuestion = True
-
-                filetype = ".txt"
-                flags = ""
-                words = shlex.split(line)
-                compileProgram = "n"
-                compiler = ""
-                runProgram = "n"
-                runCmd = ""
-
-                for i in range(len(words)):
-                    if words[i] == "-ext":
-                        if i + 1 >= len(words):
-                            print("Error! Unexpected end of arguments...")
-                        else:
-                            print(("Setting type to {0}".format(words[i + 1])))
-                            filetype = words[i + 1]
-                        i += 1
-                    if words[i] == "-flags":
-                        if i + 1 >= len(words):
-                            print("Error! Unexpected end of arguments...")
-                        else:
-                            fl = words[i + 1]
-                            print(("Setting flags to {0}".format(fl)))
-                            flags = fl
-                    if words[i] == "-com":  # check if question can be compiled
-                        if i + 1 >= len(words):
-                            print("Error! Unexpected end of arguments...")
-                        else:
-                            com = words[i + 1]
-                            print(("Setting compiler option to {0}".format(com)))
-                            compileProgram = "y"
-                            compiler = com
-                    if words[i] == "-run":  # check if question can be run
-                        if i + 1 >= len(words):
-                            print("Error! Unexpected end of arguments...")
-                        else:
-                            runCmd = words[i + 1]
-                            runProgram = "y"
-                            print(("Setting run-command option to {0}".format(runCmd)))
-                            runCmd = runCmd
-
-                line = f.readline()
-                while line and "DESCRIPTION" not in line and "QUESTION" not in line:
-                    question += line
-                    line = f.readline()
-                q = OmsiQuestion(
-                    question,
-                    len(questions),
-                    filetype,
-                    flags,
-                    compileProgram,
-                    compiler,
-                    runProgram,
-                    runCmd,
-                )
-                questions.append(q)
-                question = ""
-            else:
-                line = f.readline()
-        return questions
+        for line in f:
+            parser.feed_line(line)
+
+    return parser.close()
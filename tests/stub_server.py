@@ -0,0 +1,182 @@
+import hashlib
+import lzma
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import zlib
+
+# Stand-in for an OMSI exam server, built on the standard library only, for
+# trying the client against without a real exam. Each connection serves one
+# request and is then closed, as the stock server does. With extensions off
+# it behaves like a legacy server and hangs up on requests it does not know.
+#
+#   python tests/stub_server.py [port] [--tls]
+
+COMPRESSORS = {"zlib": zlib.compress, "lzma": lzma.compress}
+
+QUESTIONS = (
+    b"DESCRIPTION\nStand-in exam\n"
+    b"QUESTION -ext .R -run 'Rscript omsi_answer1.R'\nFirst question\n"
+    b"QUESTION\nSecond question\n"
+)
+SUPP = bytes(range(256)) * 4096
+
+
+# Creates a self-signed certificate for 127.0.0.1 in directory with the
+# openssl command line tool, since the ssl module cannot make one. Returns the
+# server's context and the certificate, for the client to trust.
+def create_tls_context(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=127.0.0.1",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1",
+            "-keyout",
+            key,
+            "-out",
+            cert,
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context, cert
+
+
+class OmsiStubServer:
+    def __init__(
+        self,
+        port=0,
+        questions=QUESTIONS,
+        supp=SUPP,
+        encodings=tuple(COMPRESSORS),
+        extensions=True,
+        tls_context=None,
+    ):
+        self.files = {"ClientWantsQuestions": questions, "ClientWantsSuppFile": supp}
+        self.encodings = encodings
+        self.extensions = extensions
+        self.tls_context = tls_context
+        self.requests = []
+        self.uploads = {}
+        self.listener = socket.create_server(("127.0.0.1", port))
+        self.port = self.listener.getsockname()[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.listener.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn):
+        try:
+            if self.tls_context is not None:
+                conn = self.tls_context.wrap_socket(conn, server_side=True)
+
+            fields = conn.recv(4096).decode().split("\0")
+            self.requests.append(fields[0])
+            self.handle(conn, fields)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def handle(self, conn, fields):
+        command = fields[0]
+
+        if command in self.files:
+            conn.sendall(self.files[command] + b"\0")
+        elif command == "OMSI0001":
+            self.receive_upload(conn, fields[1])
+        elif not self.extensions:
+            return
+        elif command == "ClientWantsCompressed":
+            self.send_compressed(conn, fields[1], fields[2].split(","))
+        elif command == "ClientWantsIfChanged":
+            body = self.files[fields[1]]
+
+            if hashlib.sha256(body).hexdigest() == fields[2]:
+                conn.sendall(b"FileNotModified\0")
+            else:
+                conn.sendall(b"FileModified\0" + body + b"\0")
+
+    def send_compressed(self, conn, command, offered):
+        encoding = next(
+            (encoding for encoding in self.encodings if encoding in offered),
+            "identity",
+        )
+        body = self.files[command]
+
+        if encoding != "identity":
+            body = COMPRESSORS[encoding](body)
+
+        conn.sendall(f"CompressedFile\0{encoding}\0{len(body)}\0".encode() + body)
+
+    # The upload ends when the client goes quiet, the reply is not terminated.
+    def receive_upload(self, conn, file_name):
+        conn.sendall(b"ReadyToAcceptClientFile")
+        conn.settimeout(0.5)
+        body = b""
+
+        try:
+            while True:
+                chunk = conn.recv(65536)
+
+                if not chunk:
+                    break
+
+                body += chunk
+        except socket.timeout:
+            pass
+
+        self.uploads[file_name] = body
+        conn.sendall(f"Received {len(body)} bytes".encode())
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 0
+    tls_context = None
+
+    if "--tls" in sys.argv:
+        tls_context, cert = create_tls_context(tempfile.mkdtemp())
+        print(f"Certificate in {cert}")
+
+    server = OmsiStubServer(port, tls_context=tls_context)
+    print(f"Listening on 127.0.0.1:{server.port}")
+    server.run()
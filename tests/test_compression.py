@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from omsi_client import (
+    COMMAND_GET_QUESTIONS,
+    COMMAND_GET_SUPP,
+    OmsiFileSink,
+    OmsiSocketClient,
+)
+from stub_server import QUESTIONS, SUPP, OmsiStubServer
+
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def fetch(self, server, command):
+        client = OmsiSocketClient(
+            "127.0.0.1", server.port, "student@example.com", "exam", compression=True
+        )
+        path = os.path.join(self.dir.name, "file")
+
+        with OmsiFileSink(path) as sink:
+            client.fetch_file(command, sink)
+
+        with open(path, "rb") as f:
+            return f.read()
+
+    def check_encoding(self, encodings):
+        with OmsiStubServer(encodings=encodings) as server:
+            self.assertEqual(self.fetch(server, COMMAND_GET_QUESTIONS), QUESTIONS)
+            self.assertEqual(self.fetch(server, COMMAND_GET_SUPP), SUPP)
+            self.assertEqual(server.requests, ["ClientWantsCompressed"] * 2)
+
+    def test_zlib(self):
+        self.check_encoding(("zlib",))
+
+    def test_lzma(self):
+        self.check_encoding(("lzma",))
+
+    def test_identity(self):
+        self.check_encoding(())
+
+    def test_legacy_server(self):
+        with OmsiStubServer(extensions=False) as server:
+            self.assertEqual(self.fetch(server, COMMAND_GET_QUESTIONS), QUESTIONS)
+            self.assertEqual(self.fetch(server, COMMAND_GET_SUPP), SUPP)
+            # Only the first request tries the extension.
+            self.assertEqual(
+                server.requests,
+                [
+                    "ClientWantsCompressed",
+                    "ClientWantsQuestions",
+                    "ClientWantsSuppFile",
+                ],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import asyncio
+import io
+import os
+import tempfile
+import unittest
+
+from omsi_client import OmsiAsyncClient, OmsiSocketClient
+from omsi_ratelimit import OmsiTokenBucket
+from stub_server import OmsiStubServer
+
+UPLOAD = os.urandom(400 * 1024)
+
+
+# The server takes an upload to be over once the client goes quiet, so a
+# paced upload must not pause for long between chunks.
+class RateLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.server = OmsiStubServer().start()
+        self.limit = OmsiTokenBucket(200 * 1024, 64 * 1024)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def client(self, client_class=OmsiSocketClient):
+        return client_class(
+            "127.0.0.1",
+            self.server.port,
+            "student@example.com",
+            "exam",
+            upload_limit=self.limit,
+        )
+
+    def check_upload(self, name, res):
+        self.assertEqual(res, f"Received {len(UPLOAD)} bytes")
+        self.assertEqual(self.server.uploads[name], UPLOAD)
+
+    def test_limited_upload_from_memory(self):
+        res = self.client().send_file_with_retry("a.R", io.BytesIO(UPLOAD))
+        self.check_upload("a.R", res)
+
+    def test_limited_upload_from_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "answer")
+
+            with open(path, "wb") as f:
+                f.write(UPLOAD)
+
+            res = self.client().send_file_with_retry("b.R", file_path=path)
+
+        self.check_upload("b.R", res)
+
+    def test_limited_async_upload(self):
+        client = self.client(OmsiAsyncClient)
+        res = asyncio.run(client.send_file_with_retry("c.R", io.BytesIO(UPLOAD)))
+        self.check_upload("c.R", res)
+
+
+if __name__ == "__main__":
+    unittest.main()
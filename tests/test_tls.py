@@ -0,0 +1,43 @@
+import shutil
+import tempfile
+import unittest
+
+from omsi_client import COMMAND_GET_QUESTIONS, OmsiSocketClient
+from omsi_connect import create_tls_context
+from stub_server import QUESTIONS, OmsiStubServer
+from stub_server import create_tls_context as create_server_context
+
+
+@unittest.skipIf(shutil.which("openssl") is None, "needs the openssl command")
+class TlsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        server_context, cert = create_server_context(self.dir.name)
+        self.server = OmsiStubServer(tls_context=server_context).start()
+        self.client = OmsiSocketClient(
+            "127.0.0.1",
+            self.server.port,
+            "student@example.com",
+            "exam",
+            tls_context=create_tls_context(cert),
+        )
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        self.dir.cleanup()
+
+    def fetch(self):
+        self.client.open()
+        reused = self.client.socket.session_reused
+        data = bytes(self.client.request_file(COMMAND_GET_QUESTIONS).getbuffer())
+        self.client.close()
+        return data, reused
+
+    def test_second_connection_resumes_session(self):
+        self.assertEqual(self.fetch(), (QUESTIONS, False))
+        self.assertEqual(self.fetch(), (QUESTIONS, True))
+
+
+if __name__ == "__main__":
+    unittest.main()